@@ -1,19 +1,62 @@
-from flask import Flask, render_template, redirect, url_for, request, flash
+from flask import Flask, render_template, redirect, url_for, request, flash, current_app, jsonify
+from flask import Response, send_file, stream_with_context
 from flask_login import LoginManager, login_required, current_user
-from models import db, User, Role, Detection 
+from models import db, User, Role, Detection, DetectionJob, TOOL_COLUMNS, configure_sqlite, ensure_columns, ensure_indexes
 from forms import UserForm, RoleForm
 from auth import auth_bp
 from rbac import require_permission, require_role
-from detect import ToolDetector
-from sqlalchemy import func
+from registry import registry
+from jobs import job_runner, run_detection
+from result_cache import result_cache
+from series import FrameSeries, load_series, series_path
+from detect import save_last_result
+from sources import CaptureSource
+from stations import stations
+from streaming import get_run, new_run, stream_detection
+from exports import EXPORT_FORMATS, available_formats, ensure_export, export_name, export_path, stream_csv
+from video import SamplingPolicy, demo_video_path
+from reports import ensure_rollups, report_totals
+from ingest import INGEST_FORMATS, ingest_detections, parse_records
+from identity import identity_cache
+from metrics import metrics
+from profiling import request_profiler
+from pagination import keyset_page, per_page_arg, prefix_filter
+from sqlalchemy import literal_column
+from sqlalchemy.orm import joinedload
 import os
 from datetime import datetime, timedelta
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__, instance_relative_config=True)
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-change-me')
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['MODEL_PATH'] = os.environ.get('MODEL_PATH', 'model/yolo_model_v11.pt')
+    app.config['MODEL_CACHE_SIZE'] = int(os.environ.get('MODEL_CACHE_SIZE', 2))
+    app.config['INFERENCE_BACKEND'] = os.environ.get('INFERENCE_BACKEND', 'torch')  # torch / onnx / openvino
+    app.config['INFERENCE_PRECISION'] = os.environ.get('INFERENCE_PRECISION', 'fp32')  # fp32 / fp16 / int8
+    app.config['INFERENCE_THREADS'] = int(os.environ.get('INFERENCE_THREADS', 0)) or None  # intra-op threads
+    app.config['INFERENCE_EXPORT_DIR'] = os.environ.get('INFERENCE_EXPORT_DIR')  # defaults to the model's folder
+    app.config['INFERENCE_CALIBRATION_DATA'] = os.environ.get('INFERENCE_CALIBRATION_DATA')  # OpenVINO INT8 only
+    app.config['DETECT_BATCH_SIZE'] = int(os.environ.get('DETECT_BATCH_SIZE', 8))
+    app.config['DETECT_STREAM_BATCH_SIZE'] = int(os.environ.get('DETECT_STREAM_BATCH_SIZE', 1))
+    app.config['DETECT_WORKERS'] = int(os.environ.get('DETECT_WORKERS', 1))
+    app.config['JOB_LEASE_SECONDS'] = int(os.environ.get('JOB_LEASE_SECONDS', 120))  # without a heartbeat, a running job is requeued after this
+    app.config['DETECT_INPUT_SIZE'] = int(os.environ.get('DETECT_INPUT_SIZE', 640))  # long side frames are resized to
+    app.config['DETECT_ROI'] = os.environ.get('DETECT_ROI')  # e.g. "0.1,0.4,0.9,1" = left,top,right,bottom fractions
+    app.config['DETECT_PROCESSES'] = int(os.environ.get('DETECT_PROCESSES', 1))  # >1 shards each video across processes
+    app.config['RESULT_CACHE_ENABLED'] = os.environ.get('RESULT_CACHE_ENABLED', '1') == '1'
+    app.config['RESULT_CACHE_MAX_ENTRIES'] = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 256))
+    app.config['RESULT_CACHE_MAX_AGE'] = int(os.environ.get('RESULT_CACHE_MAX_AGE', 7 * 24 * 3600))  # seconds
+    app.config['SERIES_MAX_ROWS'] = int(os.environ.get('SERIES_MAX_ROWS', 1000))  # per /detections/<id>/series response
+    app.config['JOB_EXPORT_FORMATS'] = ['xlsx']  # written when a background job finishes
+    app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get('IDENTITY_CACHE_TTL', 30))  # seconds, 0 disables the cache
+    app.config['INGEST_MAX_RECORDS'] = int(os.environ.get('INGEST_MAX_RECORDS', 100000))  # per bulk upload
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # lets scrapers read /metrics with "Authorization: Bearer <token>"
+    app.config['PROFILER_ENABLED'] = os.environ.get('PROFILER_ENABLED', '0') == '1'  # allows ?profile=1 for admins
+    app.config['CLASS_NAMES'] = ['drill', 'hammer', 'pliers', 'scissors', 'screwdriver', 'tape-measure', 'wrench']
+    app.config['MODEL_PRELOAD'] = os.environ.get('MODEL_PRELOAD', '1') == '1'
+    app.config.update(config or {})  # overrides, e.g. from scripts like seed.py
 
     # Ensure instance folder exists for SQLite
     try:
@@ -28,7 +71,8 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        # A cached, session-independent snapshot of the user and role (see identity.py)
+        return identity_cache.get(int(user_id))
 
     app.register_blueprint(auth_bp)
 
@@ -36,7 +80,18 @@ def create_app():
     app.register_blueprint(main_bp)
 
     with app.app_context():
+        configure_sqlite(db.engine)
+        metrics.init_app(app, db.engine)
         db.create_all()
+        ensure_columns()
+        ensure_indexes()
+        ensure_rollups()
+    request_profiler.init_app(app)
+
+    identity_cache.init_app(app)
+    registry.init_app(app)
+    result_cache.init_app(app)
+    job_runner.init_app(app)
 
     return app
 
@@ -44,6 +99,13 @@ def create_main_blueprint():
     from flask import Blueprint
     main = Blueprint('main', __name__)
 
+    def page_links(page):
+        # "First" and "Next" links for a keyset page, keeping the current filters
+        args = request.args.to_dict()
+        first_url = url_for(request.endpoint, **{k: v for k, v in args.items() if k != 'cursor'}) if 'cursor' in args else None
+        next_url = url_for(request.endpoint, **dict(args, cursor=page.next_cursor)) if page.next_cursor else None
+        return {'first_url': first_url, 'next_url': next_url}
+
     @main.route('/')
     def index():
         if current_user.is_authenticated:
@@ -59,12 +121,32 @@ def create_main_blueprint():
     @main.route('/users')
     @login_required
     def users_list():
-        if current_user.role.name == 'admin':
-            users = User.query.all()
-        else:
+        if current_user.role.name != 'admin':
             users = [User.query.filter_by(email=current_user.email.lower()).first()]
-
-        return render_template('users_list.html', users=users)
+            return render_template('users_list.html', users=users)
+
+        # e.g. /users?email=jo&role=2, one page at a time (see pagination.py)
+        email = request.args.get('email', '').strip().lower()
+        name = request.args.get('name', '').strip().lower()
+        role_id = request.args.get('role', None, type=int)
+
+        query = User.query.options(joinedload(User.role))
+        if role_id:
+            query = query.filter(User.role_id == role_id)
+        if email:
+            query = query.filter(prefix_filter(User.email, email))
+        if name:
+            query = query.filter(prefix_filter(db.func.lower(User.name), name))
+        # Ordered by the searched column, so each page is a seek on its index
+        columns = [db.func.lower(User.name), User.id] if name and not email else [User.email, User.id]
+        try:
+            page = keyset_page(query, columns, request.args.get('cursor'), per_page_arg(request.args))
+        except ValueError as e:
+            return str(e), 400
+
+        roles = Role.query.order_by(Role.name).all()
+        return render_template('users_list.html', users=page.items, roles=roles, email=email, name=name,
+                               role_id=role_id, **page_links(page))
 
     @main.route('/users/create', methods=['GET', 'POST'])
     @login_required
@@ -108,6 +190,7 @@ def create_main_blueprint():
             if form.password.data:
                 user.set_password(form.password.data)
             db.session.commit()
+            identity_cache.invalidate_user(user.id)
             flash('User updated', 'success')
             return redirect(url_for('main.users_list'))
         return render_template('user_form.html', form=form)
@@ -122,6 +205,7 @@ def create_main_blueprint():
             return redirect(url_for('main.users_list'))
         user.active = False
         db.session.commit()
+        identity_cache.invalidate_user(user.id)
         flash('User deactivated', 'success')
         return redirect(url_for('main.users_list'))
 
@@ -130,8 +214,17 @@ def create_main_blueprint():
     @login_required
     @require_role('admin')
     def roles_list():
-        roles = Role.query.all()
-        return render_template('roles_list.html', roles=roles)
+        # Case-insensitive, like the name filter on /users
+        name = request.args.get('name', '').strip().lower()
+        query = Role.query
+        if name:
+            query = query.filter(prefix_filter(db.func.lower(Role.name), name))
+        columns = [db.func.lower(Role.name), Role.id]
+        try:
+            page = keyset_page(query, columns, request.args.get('cursor'), per_page_arg(request.args))
+        except ValueError as e:
+            return str(e), 400
+        return render_template('roles_list.html', roles=page.items, name=name, **page_links(page))
 
     @main.route('/roles/create', methods=['GET', 'POST'])
     @login_required
@@ -156,6 +249,7 @@ def create_main_blueprint():
             role.name = form.name.data
             role.description = form.description.data
             db.session.commit()
+            identity_cache.invalidate_role(role.id)
             flash('Role updated', 'success')
             return redirect(url_for('main.roles_list'))
         return render_template('role_form.html', form=form)
@@ -167,29 +261,234 @@ def create_main_blueprint():
 
         tool_source = request.args.get("tool_source", "")
 
-        class_names = ['drill', 'hammer', 'pliers', 'scissors', 'screwdriver', 'tape-measure', 'wrench']
+        class_names = current_app.config['CLASS_NAMES']
 
         if tool_source == "":
-            return render_template('detector.html', class_sources=class_names)
+            return render_template('detector.html', class_sources=class_names, export_formats=available_formats())
         else:
-            # Initialize detector
-            model_path = 'model/yolo_model_v11.pt'
+            video_path = demo_video_path(tool_source)
+            if not os.path.exists(video_path):
+                return f"Video {video_path} not found", 404
+
+            # e.g. /detect?tool_source=tool1.mp4&sample_fps=2&tail_seconds=5&stable_frames=3
+            try:
+                sampling = SamplingPolicy.from_args(request.args)
+            except ValueError as e:
+                return str(e), 400
 
-            detector = ToolDetector(model_path, class_names)
+            # Long videos go to the job queue; the page polls /detect/jobs/<id>
+            if request.args.get("async"):
+                job = job_runner.submit(str(current_user.id), tool_source, sampling)
+                return render_template('detector.html', job=job.to_dict(), class_sources=class_names,
+                                       export_formats=available_formats())
 
-            # tool1.MOV = Full classes | tool2.MOV = One by one | tool3.MOV = Checking missing
-            video_path = os.path.join('demo', os.path.basename(tool_source))   # e.g. demo/tool1.mp4
             try:
-                df = detector.process_video(video_path)
-            except FileNotFoundError:
-                return f"Video {video_path} not found", 404
+                # The model stays loaded in the registry between requests
+                df = run_detection(current_app, video_path, sampling, str(current_user.id))
+            except FileNotFoundError as e:
+                return str(e), 404
             except Exception as e:
                 return f"Error processing video: {str(e)}", 500
 
             # Convert DataFrame to list
             records = df.to_dict(orient="records")
 
-            return render_template('detector.html', table=records, columns=df.columns, class_sources=class_names)
+            return render_template('detector.html', table=records, columns=df.columns, class_sources=class_names,
+                                   detection_id=df.attrs.get('detection_id'), export_formats=available_formats())
+
+    @main.route('/detect/jobs', methods=["POST"])
+    @login_required
+    def detect_jobs_create():
+        tool_source = request.values.get("tool_source", "")
+        video_path = demo_video_path(tool_source)
+        if tool_source == "" or not os.path.exists(video_path):
+            return jsonify(error=f"Video {video_path} not found"), 404
+        try:
+            sampling = SamplingPolicy.from_args(request.values)
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+
+        job = job_runner.submit(str(current_user.id), tool_source, sampling)
+        return jsonify(job.to_dict()), 202, {'Location': url_for('main.detect_job', job_id=job.id)}
+
+    @main.route('/detect/jobs/<int:job_id>', methods=["GET"])
+    @login_required
+    def detect_job(job_id):
+        job = DetectionJob.query.filter_by(id=job_id, login_id=str(current_user.id)).first_or_404()
+        return jsonify(job.to_dict())
+
+    @main.route('/detect/stream', methods=["GET"])
+    @login_required
+    def detect_stream():
+        # Server-sent events with per-class counts while the video is processed
+        tool_source = request.args.get("tool_source", "")
+        video_path = demo_video_path(tool_source)
+        if tool_source == "" or not os.path.exists(video_path):
+            return f"Video {video_path} not found", 404
+        try:
+            sampling = SamplingPolicy.from_args(request.args)
+        except ValueError as e:
+            return str(e), 400
+
+        # ?mjpeg=1 also publishes annotated frames, downscaled to preview_width, for an <img> tag
+        preview_width = request.args.get("preview_width", 640, type=int) if request.args.get("mjpeg") else None
+        if preview_width is not None and preview_width <= 0:
+            return "preview_width must be positive", 400
+        run = new_run(str(current_user.id), preview_width)
+        mjpeg_url = url_for('main.detect_stream_mjpeg', run_id=run.id) if preview_width else None
+
+        events = stream_detection(current_app._get_current_object(), video_path, sampling,
+                                  str(current_user.id), run, mjpeg_url)
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(stream_with_context(events), mimetype='text/event-stream', headers=headers)
+
+    @main.route('/detect/stream/<run_id>/mjpeg', methods=["GET"])
+    @login_required
+    def detect_stream_mjpeg(run_id):
+        run = get_run(run_id, str(current_user.id))
+        if run is None:
+            return "Stream not found", 404
+        return Response(run.iter_mjpeg(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+    # ----- Stations (live camera / stream check-in) -----
+    @main.route('/stations', methods=["GET"])
+    @login_required
+    def stations_list():
+        return jsonify([session.status() for session in stations.all()])
+
+    @main.route('/stations/<name>/start', methods=["POST"])
+    @login_required
+    @require_role('admin')
+    def stations_start(name):
+        # source: a demo file name, a camera index such as "0", or an rtsp:// / http:// URL
+        try:
+            source = CaptureSource.parse(request.values.get("source"))
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        if source.kind == 'file' and not os.path.exists(source.target):
+            return jsonify(error=f"Video {source.target} not found"), 404
+        session = stations.start(name, source, current_app.config['MODEL_PATH'], current_app.config['CLASS_NAMES'])
+        return jsonify(session.status()), 201
+
+    @main.route('/stations/<name>/stop', methods=["POST"])
+    @login_required
+    @require_role('admin')
+    def stations_stop(name):
+        session = stations.stop(name)
+        if session is None:
+            return jsonify(error=f"Station {name} is not running"), 404
+        return jsonify(session.status())
+
+    @main.route('/stations/<name>', methods=["GET"])
+    @login_required
+    def stations_status(name):
+        session = stations.get(name)
+        if session is None:
+            return jsonify(error=f"Station {name} is not running"), 404
+        return jsonify(session.status())
+
+    @main.route('/stations/<name>/mjpeg', methods=["GET"])
+    @login_required
+    def stations_mjpeg(name):
+        session = stations.get(name)
+        if session is None:
+            return "Station not found", 404
+        return Response(session.preview.iter_mjpeg(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+    @main.route('/stations/<name>/record', methods=["POST"])
+    @login_required
+    def stations_record(name):
+        # Check in whatever the station sees right now as a Detection for the current user
+        session = stations.get(name)
+        if session is None or session.counts is None:
+            return jsonify(error=f"Station {name} has no result yet"), 404
+        series = FrameSeries(session.class_names)
+        series.append(session.processed, session.counts)
+        df = save_last_result(series, str(current_user.id))
+        return jsonify(result=df.to_dict(orient="records"), detection_id=df.attrs.get('detection_id')), 201
+
+    @main.route('/detections/bulk', methods=["POST"])
+    @login_required
+    def detections_bulk():
+        # Results from edge stations: JSON lines or CSV, one detection per record, e.g.
+        # {"key": "station-3/2025-11-21T08:00:00", "created_at": "2025-11-21T08:00:00", "drill": 1, "hammer": 0, ...}
+        fmt = INGEST_FORMATS.get(request.mimetype)
+        if fmt is None:
+            return jsonify(error=f"Send one of: {', '.join(INGEST_FORMATS)}"), 415
+        try:
+            rows = parse_records(request.stream, fmt, current_app.config['INGEST_MAX_RECORDS'])
+        except ValueError as e:
+            return jsonify(error=str(e)), 400
+        summary = ingest_detections(str(current_user.id), rows)
+        return jsonify(summary), 201 if summary['created'] else 200
+
+    @main.route('/detections', methods=["GET"])
+    @login_required
+    def detections_list():
+        # e.g. /detections?start_date=2025-11-01&end_date=2025-11-21&tool=drill, newest first
+        start_date = request.args.get("start_date")
+        end_date = request.args.get("end_date")
+        tool = request.args.get("tool")
+
+        query = Detection.query.filter(Detection.login_id == str(current_user.id))
+        try:
+            if start_date:
+                query = query.filter(Detection.created_at >= datetime.fromisoformat(start_date))
+            if end_date:
+                query = query.filter(Detection.created_at < datetime.fromisoformat(end_date) + timedelta(days=1))
+            if tool:
+                column = tool.replace('-', '_')
+                if column not in TOOL_COLUMNS:
+                    raise ValueError(f"Unknown tool {tool}")
+                # A literal rather than a bound parameter, so SQLite can match the tool's partial index
+                query = query.filter(getattr(Detection, column) > literal_column('0'))
+            page = keyset_page(query, [Detection.created_at, Detection.id], request.args.get('cursor'),
+                               per_page_arg(request.args), descending=True)
+        except ValueError as e:
+            return str(e), 400
+
+        # Bulk-ingested rows and runs with no sampled frames have no series to export
+        exportable = {d.id for d in page.items if os.path.exists(series_path(d.id))}
+        return render_template('detections_list.html', detections=page.items, tools=TOOL_COLUMNS,
+                               exportable=exportable, start_date=start_date, end_date=end_date, tool=tool, **page_links(page))
+
+    @main.route('/detections/<int:detection_id>/series', methods=["GET"])
+    @login_required
+    def detection_series(detection_id):
+        # e.g. /detections/12/series?start=0&stop=500 for the first 500 analyzed frames.
+        # At most SERIES_MAX_ROWS rows per response; next_start is where the following slice begins (None at the end)
+        detection = Detection.query.filter_by(id=detection_id, login_id=str(current_user.id)).first_or_404()
+        start = request.args.get("start", 0, type=int)
+        stop = request.args.get("stop", None, type=int)
+        if start < 0 or (stop is not None and stop < 0):
+            return jsonify(error="start and stop must not be negative"), 400
+        max_rows = current_app.config['SERIES_MAX_ROWS']
+        stop = start + max_rows if stop is None else min(stop, start + max_rows)
+        loaded = load_series(detection.id, start, stop)
+        if loaded is None:
+            return jsonify(error="No per-frame series stored for this detection"), 404
+        rows, total = loaded
+        next_start = start + len(rows) if rows and start + len(rows) < total else None
+        return jsonify(detection_id=detection.id, start=start, rows=rows, total=total, next_start=next_start)
+
+    @main.route('/detections/<int:detection_id>/export/<fmt>', methods=["GET"])
+    @login_required
+    def detection_export(detection_id, fmt):
+        detection = Detection.query.filter_by(id=detection_id, login_id=str(current_user.id)).first_or_404()
+        if fmt not in EXPORT_FORMATS:
+            return f"Unsupported export format {fmt}", 404
+
+        try:
+            # CSV can be streamed straight from the series when no file was prepared
+            if fmt == 'csv' and not os.path.exists(export_path(detection.id, fmt)):
+                headers = {'Content-Disposition': f'attachment; filename={export_name(detection.id, fmt)}'}
+                return Response(stream_with_context(stream_csv(detection.id)), mimetype='text/csv', headers=headers)
+            path = ensure_export(detection.id, fmt)
+        except FileNotFoundError as e:
+            return str(e), 404
+        except ValueError as e:
+            return str(e), 400
+        return send_file(path, as_attachment=True, download_name=export_name(detection.id, fmt))
 
     @main.route('/report', methods=["GET"])
     @login_required
@@ -198,36 +497,12 @@ def create_main_blueprint():
         start_date = request.args.get("start_date")  # e.g. "2025-11-01"
         end_date = request.args.get("end_date")      # e.g. "2025-11-21"
 
-        query = db.session.query(
-            func.sum(Detection.drill).label("total_drill"),
-            func.sum(Detection.hammer).label("total_hammer"),
-            func.sum(Detection.pliers).label("total_pliers"),
-            func.sum(Detection.scissors).label("total_scissors"),
-            func.sum(Detection.screwdriver).label("total_screwdriver"),
-            func.sum(Detection.tape_measure).label("total_tape_measure"),
-            func.sum(Detection.wrench).label("total_wrench")
-        ).filter(Detection.login_id == str(current_user.id))
-
-        # Apply date filters if provided
-        if start_date:
-            start_dt = datetime.fromisoformat(start_date)
-            query = query.filter(Detection.created_at >= start_dt)
-
-        if end_date:
-            # add one day so you include the whole day
-            end_dt = datetime.fromisoformat(end_date) + timedelta(days=1)
-            query = query.filter(Detection.created_at < end_dt)
-        totals = query.first()
-
-        report_data = {
-            "drill": totals.total_drill or 0,
-            "hammer": totals.total_hammer or 0,
-            "pliers": totals.total_pliers or 0,
-            "scissors": totals.total_scissors or 0,
-            "screwdriver": totals.total_screwdriver or 0,
-            "tape_measure": totals.total_tape_measure or 0,
-            "wrench": totals.total_wrench or 0
-        }
+        start_dt = datetime.fromisoformat(start_date) if start_date else None
+        # add one day so you include the whole day
+        end_dt = datetime.fromisoformat(end_date) + timedelta(days=1) if end_date else None
+
+        # Whole days are read from the daily rollups, see reports.py
+        report_data = report_totals(str(current_user.id), start_dt, end_dt)
 
         return render_template("report.html", report=report_data, start_date=start_date, end_date=end_date)
 
@@ -0,0 +1,213 @@
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+from functools import partial
+
+import numpy as np
+from ultralytics import YOLO
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+# FP16 ONNX exports need a GPU in ultralytics, and eager PyTorch on CPU only runs FP32
+PRECISIONS = {
+    'torch': ('fp32',),
+    'onnx': ('fp32', 'int8'),
+    'openvino': ('fp32', 'fp16', 'int8'),
+}
+
+_export_lock = threading.Lock()
+
+
+def check_variant(backend, precision):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend}, expected one of {', '.join(BACKENDS)}")
+    if precision not in PRECISIONS[backend]:
+        raise ValueError(f"The {backend} backend supports {', '.join(PRECISIONS[backend])}, not {precision}")
+
+
+def variant_name(backend, precision):
+    return f'{backend}-{precision}'
+
+
+def exported_model_path(model_path, backend, precision, export_dir=None):
+    # yolo_model_v11.pt -> yolo_model_v11_fp32.onnx / yolo_model_v11_fp16_openvino_model/
+    directory = export_dir or os.path.dirname(model_path)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    if backend == 'onnx':
+        return os.path.join(directory, f'{stem}_{precision}.onnx')
+    if backend == 'openvino':
+        return os.path.join(directory, f'{stem}_{precision}_openvino_model')
+    return model_path
+
+
+def _is_stale(path, model_path):
+    return not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(model_path)
+
+
+def _replace(src, dest):
+    if os.path.isdir(dest):
+        shutil.rmtree(dest)
+    elif os.path.exists(dest):
+        os.remove(dest)
+    os.replace(src, dest)
+
+
+def _export(model_path, backend, precision, dest, imgsz, data):
+    directory = os.path.dirname(dest) or '.'
+    os.makedirs(directory, exist_ok=True)
+
+    # ultralytics writes next to the weights, so export a private copy and move the result into place
+    workdir = tempfile.mkdtemp(dir=directory, prefix='.export-')
+    try:
+        weights = os.path.join(workdir, os.path.basename(model_path))
+        shutil.copy2(model_path, weights)
+        model = YOLO(weights)
+        if backend == 'onnx':
+            exported = model.export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+            if precision == 'int8':
+                # Weight-only dynamic quantization needs no calibration set
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                quantized = os.path.join(workdir, 'int8.onnx')
+                quantize_dynamic(exported, quantized, weight_type=QuantType.QUInt8)
+                exported = quantized
+        else:
+            if precision == 'int8' and not data:
+                raise ValueError("OpenVINO INT8 export needs a calibration dataset (INFERENCE_CALIBRATION_DATA)")
+            options = {'half': True} if precision == 'fp16' else {'int8': True, 'data': data} if precision == 'int8' else {}
+            exported = model.export(format='openvino', imgsz=imgsz, dynamic=True, **options)
+        _replace(str(exported), dest)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def export_model(model_path, backend, precision='fp32', export_dir=None, imgsz=640, data=None, force=False):
+    """Exports the .pt weights for an ONNX Runtime / OpenVINO backend once and returns the cached path."""
+    check_variant(backend, precision)
+    if backend == 'torch':
+        return model_path
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model {model_path} not found")
+
+    dest = exported_model_path(model_path, backend, precision, export_dir)
+    with _export_lock:
+        # Re-exported only when the .pt is newer than the cached export
+        if force or _is_stale(dest, model_path):
+            _export(model_path, backend, precision, dest, imgsz, data)
+    return dest
+
+
+def _runtime_backend(model):
+    # The AutoBackend of the predictor; only exists once the model has run
+    predictor = getattr(model, 'predictor', None)
+    autobackend = getattr(predictor, 'model', None)
+    return getattr(autobackend, 'backend', autobackend)
+
+
+def _apply_threads(model, backend, threads, path):
+    # ultralytics builds ONNX Runtime / OpenVINO sessions with default threading, so rebuild them with ours
+    runtime = _runtime_backend(model)
+    if backend == 'onnx' and getattr(runtime, 'session', None) is not None:
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        runtime.session = onnxruntime.InferenceSession(path, options, providers=runtime.session.get_providers())
+    elif backend == 'openvino' and getattr(runtime, 'ov_compiled_model', None) is not None:
+        import openvino as ov
+        core = ov.Core()
+        xml = next(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.xml'))
+        config = {'PERFORMANCE_HINT': 'LATENCY', 'INFERENCE_NUM_THREADS': threads}
+        runtime.compile_model = partial(core.compile_model, device_name='CPU', config=config)
+        runtime.ov_compiled_model = runtime.compile_model(core.read_model(xml))
+    else:
+        print(f"Could not set the {backend} thread count, using the runtime default")
+
+
+def load_model(model_path, backend='torch', precision='fp32', threads=None, warmup_shape=(720, 1280, 3),
+               export_dir=None, imgsz=640, data=None):
+    """Returns a YOLO model running on the given backend, exporting the weights first if needed."""
+    check_variant(backend, precision)
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model {model_path} not found")
+
+    if threads:
+        import torch
+        torch.set_num_threads(threads)  # pre/post-processing stays in torch for every backend
+
+    path = export_model(model_path, backend, precision, export_dir, imgsz, data)
+    model = YOLO(path, task='detect')
+    if warmup_shape or (threads and backend != 'torch'):
+        model(np.zeros(warmup_shape or (imgsz, imgsz, 3), dtype=np.uint8), verbose=False)
+    if threads and backend != 'torch':
+        _apply_threads(model, backend, threads, path)
+    return model
+
+
+def compare_backends(video_path, model_path, class_names, variants, sampling=None, batch_size=8, threads=None,
+                     export_dir=None, data=None):
+    """Runs the video through each (backend, precision) and reports frames whose counts differ from eager FP32."""
+    from detect import ToolDetector
+
+    def counts_for(backend, precision):
+        model = load_model(model_path, backend, precision, threads, warmup_shape=None, export_dir=export_dir, data=data)
+        detector = ToolDetector(model_path, class_names, model=model)
+        return [(d.frame_num, d.counts) for d in detector.iter_detections(video_path, batch_size, sampling=sampling)]
+
+    reference = counts_for('torch', 'fp32')
+    report = {}
+    for backend, precision in variants:
+        counts = counts_for(backend, precision)
+        mismatched = [frame for (frame, expected), (_, actual) in zip(reference, counts) if expected != actual]
+        if len(counts) != len(reference):
+            mismatched.append(None)  # a different number of frames is a mismatch on its own
+        report[variant_name(backend, precision)] = {
+            'frames': len(reference),
+            'mismatched': len(mismatched),
+            'first_mismatches': mismatched[:10],
+        }
+    return report
+
+
+def parse_variant(text):
+    backend, _, precision = text.partition(':')
+    check_variant(backend, precision or 'fp32')
+    return backend, precision or 'fp32'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the detection model and check backends agree.")
+    parser.add_argument('--model', default=os.environ.get('MODEL_PATH', 'model/yolo_model_v11.pt'))
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--data', default=None, help="calibration dataset yaml for OpenVINO INT8")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help="export (or refresh) backend variants")
+    export.add_argument('variants', nargs='+', type=parse_variant, help="backend[:precision], e.g. onnx:int8")
+    export.add_argument('--force', action='store_true')
+
+    verify = commands.add_parser('verify', help="compare per-frame counts against eager PyTorch")
+    verify.add_argument('video')
+    verify.add_argument('variants', nargs='+', type=parse_variant)
+    verify.add_argument('--max-mismatch', type=float, default=0.0, help="allowed fraction of differing frames")
+    args = parser.parse_args()
+
+    class_names = list(YOLO(args.model).names.values())  # the order the weights were trained with
+
+    if args.command == 'export':
+        for backend, precision in args.variants:
+            print(export_model(args.model, backend, precision, data=args.data, force=args.force))
+        return 0
+
+    report = compare_backends(args.video, args.model, class_names, args.variants, threads=args.threads, data=args.data)
+    failed = False
+    for name, result in report.items():
+        ratio = result['mismatched'] / max(result['frames'], 1)
+        print(f"{name}: {result['mismatched']}/{result['frames']} frames differ {result['first_mismatches']}")
+        failed = failed or ratio > args.max_mismatch
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,246 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from backends import parse_variant
+from detect import ToolDetector
+from video import FrameReader, Preprocessor, SamplingPolicy
+
+# Same classes as the production weights, so the stand-in model has the same head size
+STAND_IN_CLASSES = ['drill', 'hammer', 'pliers', 'scissors', 'screwdriver', 'tape-measure', 'wrench']
+
+THROUGHPUT_METRICS = ('e2e_fps', 'decode_fps')
+
+
+def make_video(path, size=(1920, 1080), frames=120, fps=30):
+    """Writes a synthetic clip of moving blocks over noise; enough texture that decoding isn't free."""
+    rng = np.random.default_rng(0)
+    width, height = size
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    try:
+        for i in range(frames):
+            frame = background.copy()
+            for j, color in enumerate([(40, 40, 200), (40, 200, 40), (200, 40, 40), (0, 200, 200)]):
+                x = (i * (4 + j) + j * width // 4) % (width - width // 8)
+                y = height // 5 + j * height // 6
+                cv2.rectangle(frame, (x, y), (x + width // 8, y + height // 8), color, -1)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+def make_model(path, class_names=STAND_IN_CLASSES):
+    """Saves an untrained YOLO11n with our classes; same architecture as the real model, no download needed."""
+    from ultralytics import YOLO
+    from ultralytics.nn.tasks import DetectionModel
+    model = YOLO('yolo11n.yaml')
+    model.model = DetectionModel('yolo11n.yaml', nc=len(class_names), verbose=False)
+    model.model.names = dict(enumerate(class_names))
+    model.save(path)
+    return path
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10  # bytes on macOS, KiB on Linux
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values) * 1000
+    return {
+        'mean': round(float(values.mean()), 2),
+        'p50': round(float(np.percentile(values, 50)), 2),
+        'p90': round(float(np.percentile(values, 90)), 2),
+        'p99': round(float(np.percentile(values, 99)), 2),
+    }
+
+
+def case_id(case):
+    roi = f" roi={','.join(str(v) for v in case['roi'])}" if case.get('roi') else ''
+    return f"{case['backend']} input={case['input_size']}{roi} batch={case['batch_size']} stride={case['stride']}"
+
+
+def run_case(case, video_path, model_path, class_names, threads=None):
+    """Measures one configuration; run in a fresh process so peak RSS and warm-up belong to this case alone."""
+    backend, precision = parse_variant(case['backend'])
+    preprocess = Preprocessor(case['input_size'], case.get('roi'))
+    sampling = SamplingPolicy(stride=case['stride'])
+    batch_size = case['batch_size']
+
+    detector = ToolDetector(model_path, class_names, backend=backend, precision=precision, threads=threads,
+                            preprocess=preprocess)
+    size = case['input_size']
+    detector.infer_batch([np.zeros((size, size, 3), dtype=np.uint8)] * batch_size)  # warm-up
+
+    # Decode and preprocess only
+    started = time.perf_counter()
+    decoded = 0
+    with FrameReader(video_path, preprocess, sampling=sampling) as reader:
+        for _ in reader:
+            decoded += 1
+    decode_seconds = time.perf_counter() - started
+
+    # Model latency per batch and count post-processing per frame, frames decoded ahead on the reader thread
+    inference, postprocess = [], []
+    with FrameReader(video_path, preprocess, sampling=sampling, held_frames=batch_size) as reader:
+        batch = []
+        for _, frame in reader:
+            batch.append(frame)
+            if len(batch) < batch_size:
+                continue
+            started = time.perf_counter()
+            results = detector.infer_batch(batch)
+            inference.append(time.perf_counter() - started)
+            for frame, result in zip(batch, results):
+                started = time.perf_counter()
+                detector.detect_and_count(frame, result)
+                postprocess.append(time.perf_counter() - started)
+            batch = []
+
+    # The whole pipeline as /detect runs it, minus the database write
+    started = time.perf_counter()
+    series = detector.detect(video_path, batch_size, sampling=sampling)
+    e2e_seconds = time.perf_counter() - started
+
+    return {
+        'id': case_id(case),
+        'case': case,
+        'frames': len(series),
+        'decode_fps': round(decoded / decode_seconds, 2) if decode_seconds else None,
+        'inference_ms': _percentiles(inference),  # per batch
+        'inference_per_frame_ms': round(1000 * sum(inference) / (len(inference) * batch_size), 2) if inference else None,
+        'postprocess_ms': _percentiles(postprocess),
+        'e2e_fps': round(len(series) / e2e_seconds, 2) if e2e_seconds else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def run_isolated(case, *args):
+    # maxtasksperchild=1: a new interpreter per case
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(run_case, (case,) + args)
+
+
+def find_regressions(results, baseline, threshold):
+    previous = {result['id']: result for result in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get(result['id'])
+        if before is None:
+            continue
+        for metric in THROUGHPUT_METRICS:
+            if before.get(metric) and result.get(metric) is not None and \
+                    result[metric] < before[metric] * (1 - threshold):
+                regressions.append({'id': result['id'], 'metric': metric,
+                                    'baseline': before[metric], 'current': result[metric]})
+    return regressions
+
+
+def _int_list(text):
+    return [int(v) for v in text.split(',')]
+
+
+def _str_list(text):
+    return [v.strip() for v in text.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the detection pipeline and check for slowdowns.")
+    parser.add_argument('--model', help="weights to benchmark (default: a generated stand-in model)")
+    parser.add_argument('--video', help="video to benchmark (default: a generated synthetic clip)")
+    parser.add_argument('--source-size', default='1920x1080', help="size of the generated clip")
+    parser.add_argument('--frames', type=int, default=120, help="length of the generated clip")
+    parser.add_argument('--input-sizes', type=_int_list, default=[640, 480], help="model input sizes (long side)")
+    parser.add_argument('--roi', type=Preprocessor.parse_roi, default=None, help="left,top,right,bottom fractions")
+    parser.add_argument('--batch-sizes', type=_int_list, default=[1, 8])
+    parser.add_argument('--strides', type=_int_list, default=[1])
+    parser.add_argument('--backends', type=_str_list, default=['torch:fp32'], help="backend[:precision] list")
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'tool_detector_bench'))
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--baseline', help="earlier JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="allowed throughput drop, 0.10 = 10%%")
+    args = parser.parse_args()
+
+    # Fail fast on typos, and spell variants out so report ids match between runs ('onnx' -> 'onnx:fp32')
+    args.backends = ['%s:%s' % parse_variant(backend) for backend in args.backends]
+
+    # Generated inputs are cached in workdir, so reruns compare like with like
+    os.makedirs(args.workdir, exist_ok=True)
+    model_path = args.model or os.path.join(args.workdir, 'stand_in.pt')
+    if not os.path.exists(model_path):
+        make_model(model_path)
+    video_path = args.video
+    if not video_path:
+        width, height = (int(v) for v in args.source_size.split('x'))
+        video_path = os.path.join(args.workdir, f'synthetic_{width}x{height}_{args.frames}.mp4')
+        if not os.path.exists(video_path):
+            make_video(video_path, (width, height), args.frames)
+
+    from ultralytics import YOLO
+    class_names = list(YOLO(model_path).names.values())
+
+    results = []
+    for backend in args.backends:
+        for input_size in args.input_sizes:
+            for batch_size in args.batch_sizes:
+                for stride in args.strides:
+                    case = {'backend': backend, 'input_size': input_size, 'roi': args.roi, 'batch_size': batch_size,
+                            'stride': stride}
+                    result = run_isolated(case, video_path, model_path, class_names, args.threads)
+                    print(f"{result['id']}: {result['e2e_fps']} fps end-to-end, {result['decode_fps']} fps decode, "
+                          f"inference p50 {result['inference_ms']['p50'] if result['inference_ms'] else '-'} ms, "
+                          f"{result['peak_rss_mb']} MB peak", file=sys.stderr)
+                    results.append(result)
+
+    report = {
+        'meta': {
+            'created_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'threads': args.threads,
+            'model': os.path.basename(model_path),
+            'video': os.path.basename(video_path),
+        },
+        'results': results,
+    }
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['regressions'] = find_regressions(results, json.load(f), args.threshold)
+        for regression in report['regressions']:
+            print(f"REGRESSION {regression['id']}: {regression['metric']} {regression['baseline']} -> "
+                  f"{regression['current']}", file=sys.stderr)
+        status = 1 if report['regressions'] else 0
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return status
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
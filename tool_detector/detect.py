@@ -1,24 +1,58 @@
 import cv2
-from ultralytics import YOLO
 import pandas as pd
 from collections import Counter
 import numpy as np  # Added for average calculation
 import os
-from models import db, Detection
+from contextlib import nullcontext
+from models import db, Detection, TOOL_COLUMNS
 from flask_login import current_user
+from backends import load_model
+from metrics import metrics
+from tracking import TRACK_CONF, TrackCounter
+from series import FrameSeries, series_path
+from video import FrameReader, Preprocessor, SamplingPolicy, VideoSink, probe
+
+# Set bounding box colors
+BBOX_COLORS = [(164,120,87), (68,148,228), (93,97,209), (178,182,133), (88,159,106), 
+               (96,202,231), (159,124,168), (169,162,241), (98,118,150), (172,176,184)]
+
+class FrameDetection:
+    def __init__(self, frame_num, frame, results, counts):
+        self.frame_num = frame_num
+        self.frame = frame
+        self.results = results
+        self.counts = counts
 
 class ToolDetector:
-    def __init__(self, model_path, class_names):
-        self.model = YOLO(model_path)
+    def __init__(self, model_path, class_names, model=None, backend='torch', precision='fp32', threads=None,
+                 preprocess=None, lock=None, export_dir=None, data=None):
+        # Pass a preloaded model (see registry.py) to skip loading the weights again
+        self.model_path = model_path
+        if model is None:
+            # ONNX Runtime / OpenVINO weights are exported from model_path once and reused (see backends.py)
+            model = load_model(model_path, backend, precision, threads, warmup_shape=None, export_dir=export_dir,
+                               data=data)
+        self.model = model
         self.class_names = class_names
-
-    def detect_and_count(self, frame):
-        results = self.model(frame)[0]  # Run inference on the frame
-        detections = results.boxes.cls.cpu().numpy()  # Get class indices of detections
-        confs = results.boxes.conf.cpu().numpy()  # Get confidence scores
-        count = Counter(detections)  # Count occurrences per class
-        #class_counts = {class_names[int(cls)]: count.get(cls, 0) for cls in range(len(class_names))}
-        class_counts = {self.class_names[int(cls)]: 1 if cls in count else 0 for cls in range(len(self.class_names))}
+        # Frames are cropped to the ROI and resized once, to the size the model runs at
+        self.preprocess = preprocess or Preprocessor()
+        # A model shared between threads is locked per inference call, not for a whole video
+        self.lock = lock or nullcontext()
+
+    def infer(self, frame):
+        with self.lock, metrics.span('inference'):
+            return self.model(frame, imgsz=self.preprocess.input_size, verbose=False)[0]
+
+    def detect_and_count(self, frame, results=None):
+        # Reuse precomputed results when the caller already ran the model on this frame
+        if results is None:
+            results = self.infer(frame)  # Run inference on the frame
+        with metrics.span('postprocess'):
+            detections = results.boxes.cls.cpu().numpy()  # Get class indices of detections
+            confs = results.boxes.conf.cpu().numpy()  # Get confidence scores
+            count = Counter(detections)  # Count occurrences per class
+            #class_counts = {class_names[int(cls)]: count.get(cls, 0) for cls in range(len(class_names))}
+            class_counts = {self.class_names[int(cls)]: 1 if cls in count else 0 for cls in range(len(self.class_names))}
 
         # Calculate total objects detected (sum of all class counts)
         total = sum(class_counts.values())
@@ -26,90 +60,144 @@ class ToolDetector:
 
         return class_counts
 
-    def process_video(self, video_path):
-        
-        output_excel = 'demo/result.xlsx'  # output
-
-        # Process the video
-        cap = cv2.VideoCapture(video_path)
-        resW, resH= 1280, 720 # Width, Height
-  
-        ret = cap.set(cv2.CAP_PROP_FRAME_WIDTH, resW) 
-        ret = cap.set(cv2.CAP_PROP_FRAME_HEIGHT, resH) 
-
-        fps = cap.get(cv2.CAP_PROP_FPS)  # Get frames per second
-
-        if not fps or fps <= 0:
-            raise ValueError("Could not retrieve FPS from video.")
-
-        # Set bounding box colors
-        bbox_colors = [(164,120,87), (68,148,228), (93,97,209), (178,182,133), (88,159,106), 
-                    (96,202,231), (159,124,168), (169,162,241), (98,118,150), (172,176,184)]
-
-        frame_counts = []
-        frame_num = 0
-        df = pd.DataFrame()
-
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            frame = cv2.resize(frame,(resW,resH))
-        
-            results = self.model(frame, verbose=False)[0]
-
-            counts = self.detect_and_count(frame)
-
-            frame_counts.append(counts)
-            frame_num += 1
-            
-            # Draw bounding boxes
-            for box, cls, conf in zip(results.boxes.xyxy, results.boxes.cls, results.boxes.conf):
-                x1, y1, x2, y2 = map(int, box)
-                color = bbox_colors[int(cls) % len(bbox_colors)]
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                cv2.putText(frame, f"{self.class_names[int(cls)]} {conf:.2f}",
-                            (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-
-            # Show the video frame in a window
-            window_name ="Tool Detection"
-            cv2.imshow(window_name, frame)
-            key = cv2.waitKey(5)
-            if cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) < 1:
-                break
-            elif key == ord('q') or key == ord('Q'): # Press 'q' to quit
-                break
-            elif key == ord('s') or key == ord('S'): # Press 's' to pause inference
-                cv2.waitKey()
-                
-        cap.release()
-        cv2.destroyAllWindows()
-
-        # Only display the last result
-        if frame_counts:  # make sure we actually have results
-            last_result = frame_counts[-1]   # take the last frame's counts
-            df = pd.DataFrame([last_result]) # wrap in list so DataFrame builds one row
-            df.to_excel(output_excel, index=False)
-
-            # Save each frame’s detections into DB
-            for _, row in df.iterrows():
-                detection = Detection(
-                    login_id=str(current_user.id),
-                    drill=int(row.get("drill", 0)),
-                    hammer=int(row.get("hammer", 0)),
-                    pliers=int(row.get("pliers", 0)),
-                    scissors=int(row.get("scissors", 0)),
-                    screwdriver=int(row.get("screwdriver", 0)),
-                    tape_measure=int(row.get("tape-measure", 0)),  # rename column in df if needed
-                    wrench=int(row.get("wrench", 0))
-                )
-                db.session.add(detection)
-
+    def draw_boxes(self, frame, results):
+        # Draw bounding boxes
+        for box, cls, conf in zip(results.boxes.xyxy, results.boxes.cls, results.boxes.conf):
+            x1, y1, x2, y2 = map(int, box)
+            color = BBOX_COLORS[int(cls) % len(BBOX_COLORS)]
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+            cv2.putText(frame, f"{self.class_names[int(cls)]} {conf:.2f}",
+                        (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+        return frame
+
+    def infer_batch(self, frames, **overrides):
+        with self.lock, metrics.span('inference'):
+            return self.model(frames, imgsz=self.preprocess.input_size, verbose=False, **overrides)
+
+    def iter_detections(self, video_path, batch_size=8, annotate=False, sampling=None, start_frame=None, stop_frame=None):
+        sampling = sampling or SamplingPolicy()
+        stable, last_counts = 0, None
+        for detection in self._iter_batches(video_path, batch_size, annotate, sampling, start_frame, stop_frame):
+            yield detection
+
+            # Early exit once the per-class result has stopped changing
+            if sampling.stable_frames:
+                stable = stable + 1 if detection.counts == last_counts else 1
+                last_counts = detection.counts
+                if stable >= sampling.stable_frames:
+                    return
+
+    def _iter_batches(self, video_path, batch_size, annotate, sampling, start_frame=None, stop_frame=None):
+        # Frames are decoded on a background thread and fed to the model in batches
+        with FrameReader(video_path, self.preprocess, sampling=sampling, start_frame=start_frame,
+                         stop_frame=stop_frame, held_frames=batch_size) as reader:
+            # Tracking mode: sampled frames are keyframes, the tracker links them and counts unique tools
+            tracks = None
+            if sampling.tracker:
+                tracks = TrackCounter(self.class_names, sampling.tracker, frame_rate=reader.fps / sampling.step(reader.fps))
+            batch = []
+            for frame_num, frame in reader:
+                batch.append((frame_num, frame))
+                if len(batch) >= batch_size:
+                    yield from self._run_batch(batch, annotate, tracks)
+                    batch = []
+            if batch:
+                yield from self._run_batch(batch, annotate, tracks)
+
+    def _run_batch(self, batch, annotate, tracks=None):
+        # Inference stays batched; only the tracker update has to go frame by frame, in order
+        if tracks:
+            results = self.infer_batch([frame for _, frame in batch], conf=TRACK_CONF)
+        else:
+            results = self.infer_batch([frame for _, frame in batch])
+        for (frame_num, frame), result in zip(batch, results):
+            counts = tracks.update(result, frame) if tracks else self.detect_and_count(frame, result)
+            if annotate:
+                self.draw_boxes(frame, result)
+            yield FrameDetection(frame_num, frame, result, counts)
+
+    def process_video(self, video_path, batch_size=8, output_video=None, show=False, sampling=None,
+                      login_id=None, progress=None):
+
+        # Outside a request (e.g. a background job) the caller passes the user explicitly
+        if login_id is None:
+            login_id = str(current_user.id)
+
+        frame_counts = self.detect(video_path, batch_size, output_video, show, sampling, progress)
+        return save_last_result(frame_counts, login_id)
+
+    def detect(self, video_path, batch_size=8, output_video=None, show=False, sampling=None, progress=None,
+               series=None, on_detection=None, annotate=False):
+        # Per-frame counts go into a compact array-backed series (streamed to disk if it has a path)
+        frame_counts = series if series is not None else FrameSeries(self.class_names)
+
+        fps, frame_total = probe(video_path)
+
+        # Rendering is opt-in: an annotated MP4 and/or a preview window for local runs
+        sink = VideoSink(output_video, fps) if output_video else None
+        window_name = "Tool Detection"
+
+        detections = self.iter_detections(video_path, batch_size, annotate=bool(annotate or sink or show),
+                                          sampling=sampling)
+        try:
+            for detection in detections:
+                frame_counts.append(detection.frame_num, detection.counts)
+
+                # Per-frame hook, e.g. live previews and progress events (see streaming.py)
+                if on_detection:
+                    on_detection(detection)
+
+                if progress:
+                    progress(detection.frame_num + 1, frame_total)
+
+                if sink:
+                    sink.write(detection.frame)
+
+                if show:
+                    # Show the video frame in a window
+                    cv2.imshow(window_name, detection.frame)
+                    key = cv2.waitKey(5)
+                    if cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) < 1:
+                        break
+                    elif key == ord('q') or key == ord('Q'): # Press 'q' to quit
+                        break
+                    elif key == ord('s') or key == ord('S'): # Press 's' to pause inference
+                        cv2.waitKey()
+        finally:
+            detections.close()  # stops the frame reader at once if we stopped early
+            if sink:
+                sink.close()
+            if show:
+                cv2.destroyAllWindows()
+
+        frame_counts.flush()
+        return frame_counts
+
+
+def save_last_result(frame_counts, login_id):
+    df = pd.DataFrame()
+
+    # Only display the last result
+    if len(frame_counts):  # make sure we actually have results
+        last_result = frame_counts.last()   # take the last frame's counts
+        df = pd.DataFrame([last_result]) # wrap in list so DataFrame builds one row
+
+        # Save the result into DB; class names use '-', columns '_' (tape-measure -> tape_measure)
+        detection = Detection(
+            login_id=login_id,
+            **{col: int(last_result.get(col.replace('_', '-'), 0)) for col in TOOL_COLUMNS}
+        )
+        db.session.add(detection)
+
+        with metrics.span('db_commit'):
             db.session.commit()
 
-            print(f"Last frame counts exported to {output_excel}")
-        else:
-            print("No detections found, nothing to export.")
+        # Keep the full per-frame series next to the Detection row for audits
+        frame_counts.save(series_path(detection.id))
+        df.attrs['detection_id'] = detection.id  # exports are served per detection, see exports.py
+
+        print(f"Last frame counts saved as detection {detection.id}")
+    else:
+        print("No detections found, nothing to export.")
 
-        return df
\ No newline at end of file
+    return df
\ No newline at end of file
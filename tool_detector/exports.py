@@ -0,0 +1,150 @@
+import csv
+import io
+import os
+import tempfile
+
+import numpy as np
+from flask import current_app
+
+from metrics import metrics
+from series import series_path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+
+EXPORT_FORMATS = ('csv', 'xlsx', 'parquet')
+CHUNK_ROWS = 4096
+
+
+def available_formats():
+    # Formats that can be written here; Parquet needs the optional pyarrow
+    return [fmt for fmt in EXPORT_FORMATS if fmt != 'parquet' or pq is not None]
+
+
+def export_dir():
+    directory = current_app.config.get('EXPORT_DIR') or os.path.join(current_app.instance_path, 'exports')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def export_name(detection_id, fmt):
+    return f'detection-{detection_id}.{fmt}'
+
+
+def export_path(detection_id, fmt):
+    return os.path.join(export_dir(), export_name(detection_id, fmt))
+
+
+def _open_series(detection_id):
+    path = series_path(detection_id)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No per-frame series stored for detection {detection_id}")
+    return np.load(path, mmap_mode='r')
+
+
+def _columns(array):
+    return list(array.dtype.names) + ['total']
+
+
+def _iter_chunks(array):
+    # Rows are read from the memory-mapped series a chunk at a time, so memory stays flat
+    class_names = [name for name in array.dtype.names if name != 'frame']
+    for start in range(0, len(array), CHUNK_ROWS):
+        chunk = np.asarray(array[start:start + CHUNK_ROWS])
+        total = np.zeros(len(chunk), dtype=np.int64)
+        for name in class_names:
+            total += chunk[name]
+        yield chunk, total
+
+
+def _iter_rows(array):
+    for chunk, total in _iter_chunks(array):
+        for row, row_total in zip(chunk.tolist(), total.tolist()):
+            yield list(row) + [row_total]
+
+
+def stream_csv(detection_id):
+    # Chunks for a streamed download response; nothing is written to disk
+    return _csv_chunks(_open_series(detection_id))
+
+
+def _csv_chunks(array):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(_columns(array))
+    for chunk, total in _iter_chunks(array):
+        for row, row_total in zip(chunk.tolist(), total.tolist()):
+            writer.writerow(list(row) + [row_total])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _write_csv(array, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(_columns(array))
+        writer.writerows(_iter_rows(array))
+
+
+def _write_xlsx(array, path):
+    from openpyxl import Workbook
+    # write_only mode streams rows to the file instead of building the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('detections')
+    sheet.append(_columns(array))
+    for row in _iter_rows(array):
+        sheet.append(row)
+    workbook.save(path)
+
+
+def _write_parquet(array, path):
+    if pq is None:
+        raise ValueError("Parquet export needs pyarrow installed")
+    columns = _columns(array)
+    writer = None
+    try:
+        for chunk, total in _iter_chunks(array):
+            arrays = [pa.array(chunk[name]) for name in array.dtype.names] + [pa.array(total)]
+            table = pa.Table.from_arrays(arrays, names=columns)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pq.write_table(pa.table({name: [] for name in columns}), path)
+
+
+_WRITERS = {'csv': _write_csv, 'xlsx': _write_xlsx, 'parquet': _write_parquet}
+
+
+def write_export(detection_id, fmt):
+    if fmt not in _WRITERS:
+        raise ValueError(f"Unsupported export format {fmt}")
+    array = _open_series(detection_id)
+    path = export_path(detection_id, fmt)
+
+    # Written under a temp name and renamed, so a download never sees a half-written file
+    fd, tmp_path = tempfile.mkstemp(dir=export_dir(), suffix='.tmp')
+    os.close(fd)
+    try:
+        with metrics.span('export'):
+            _WRITERS[fmt](array, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def ensure_export(detection_id, fmt):
+    path = export_path(detection_id, fmt)
+    if os.path.exists(path):
+        return path
+    return write_export(detection_id, fmt)
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from sqlalchemy.orm import joinedload
+
+from models import db, User
+
+
+class RoleIdentity:
+    """Read-only copy of a Role with its permissions parsed once."""
+
+    def __init__(self, role):
+        self.id = role.id
+        self.name = role.name
+        self.description = role.description
+        # Same matching as Role.has_perm, without re-splitting the string on every check
+        self.permissions = frozenset(role.permissions.split(',')) if role.permissions else frozenset()
+
+    def has_perm(self, code: str) -> bool:
+        return code in self.permissions
+
+
+class Identity(UserMixin):
+    """What a request needs to know about the logged-in user, detached from any DB session."""
+
+    def __init__(self, user):
+        self.id = user.id
+        self.email = user.email
+        self.name = user.name
+        self.active = user.active
+        self.role_id = user.role_id
+        self.role = RoleIdentity(user.role) if user.role else None
+
+    @property
+    def is_active(self) -> bool:
+        return self.active
+
+
+class IdentityCache:
+    """Short-lived per-process cache of identities, so load_user doesn't hit the database on every request.
+
+    Edits made in this process invalidate entries at once; other worker processes see them after ttl seconds.
+    """
+
+    def __init__(self, ttl=30, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # user id -> (expires_at, identity)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', self.ttl)
+        app.extensions['identity_cache'] = self
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        identity = self.load(user_id)
+        if identity is not None and self.ttl > 0:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, identity)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return identity
+
+    def load(self, user_id):
+        # User and role in one joined query
+        user = db.session.execute(
+            db.select(User).options(joinedload(User.role)).where(User.id == user_id)
+        ).scalar_one_or_none()
+        return Identity(user) if user is not None else None
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def invalidate_role(self, role_id):
+        with self._lock:
+            for user_id in [user_id for user_id, (_, identity) in self._entries.items() if identity.role_id == role_id]:
+                self._entries.pop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+identity_cache = IdentityCache()
@@ -0,0 +1,168 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from metrics import metrics
+from models import db, Detection, DetectionIngestKey, TOOL_COLUMNS
+from reports import apply_rollups
+
+INGEST_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'jsonl',
+    'application/jsonl': 'jsonl',
+    'application/json-lines': 'jsonl',
+}
+MAX_KEY_LENGTH = 128
+KEY_CHUNK = 500  # keys per IN (...) lookup, well under SQLite's bound-parameter limit
+
+
+def _count(record, col, line):
+    # Columns may be named after the class ('tape-measure') or the DB column ('tape_measure')
+    value = record.get(col, record.get(col.replace('_', '-')))
+    if value is None or value == '':
+        return 0
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"line {line}: {col} must be an integer")
+    if value < 0:
+        raise ValueError(f"line {line}: {col} must not be negative")
+    return value
+
+
+def _created_at(value, line):
+    if not value:
+        return datetime.utcnow()
+    try:
+        created_at = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"line {line}: created_at must be an ISO 8601 timestamp")
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)  # stored as naive UTC like the ORM path
+    return created_at
+
+
+def record_row(record, line):
+    """Validates one uploaded record and returns its detection row (with the client key, if any)."""
+    if not isinstance(record, dict):
+        raise ValueError(f"line {line}: expected an object")
+    key = record.get('key')
+    if key is not None and key != '':
+        key = str(key)
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValueError(f"line {line}: key is longer than {MAX_KEY_LENGTH} characters")
+    else:
+        key = None
+    row = {col: _count(record, col, line) for col in TOOL_COLUMNS}
+    row['created_at'] = _created_at(record.get('created_at'), line)
+    row['key'] = key
+    return row
+
+
+def _jsonl_records(text):
+    for line, raw in enumerate(text, start=1):
+        if not raw.strip():
+            continue
+        try:
+            yield line, json.loads(raw)
+        except json.JSONDecodeError:
+            raise ValueError(f"line {line}: invalid JSON")
+
+
+def _csv_records(text):
+    # The header is line 1, so the first record is line 2
+    for line, record in enumerate(csv.DictReader(text), start=2):
+        yield line, record
+
+
+def parse_records(stream, fmt, max_records=None):
+    """Reads JSON lines or CSV from a binary stream into validated detection rows."""
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='' if fmt == 'csv' else None)
+    records = _csv_records(text) if fmt == 'csv' else _jsonl_records(text)
+    rows = []
+    for line, record in records:
+        rows.append(record_row(record, line))
+        if max_records and len(rows) > max_records:
+            raise ValueError(f"At most {max_records} records per upload")
+    return rows
+
+
+def _existing_keys(login_id, keys):
+    existing = {}
+    keys = list(keys)
+    for start in range(0, len(keys), KEY_CHUNK):
+        query = select(DetectionIngestKey.client_key, DetectionIngestKey.detection_id).where(
+            DetectionIngestKey.login_id == login_id,
+            DetectionIngestKey.client_key.in_(keys[start:start + KEY_CHUNK]),
+        )
+        existing.update(db.session.execute(query).all())
+    return existing
+
+
+def _insert(login_id, rows):
+    keys = {row['key'] for row in rows if row['key'] is not None}
+    existing = _existing_keys(login_id, keys)
+
+    # A key already stored, or repeated within this upload, is only inserted once
+    pending, pending_keys, seen = [], [], set()
+    for row in rows:
+        if row['key'] is not None:
+            if row['key'] in existing or row['key'] in seen:
+                continue
+            seen.add(row['key'])
+        pending.append(dict({col: row[col] for col in TOOL_COLUMNS}, login_id=login_id, created_at=row['created_at']))
+        pending_keys.append(row['key'])
+    if not pending:
+        return existing, []
+
+    # One executemany per statement; bulk inserts skip the flush hooks, so the rollups are applied here
+    ids = db.session.execute(
+        insert(Detection).returning(Detection.id, sort_by_parameter_order=True), pending
+    ).scalars().all()
+    keyed = [{'login_id': login_id, 'client_key': key, 'detection_id': detection_id}
+             for key, detection_id in zip(pending_keys, ids) if key is not None]
+    if keyed:
+        db.session.execute(insert(DetectionIngestKey), keyed)
+    apply_rollups(db.session.connection(), pending)
+    return existing, list(zip(pending_keys, ids))
+
+
+def ingest_detections(login_id, rows, attempts=2):
+    """Inserts detection rows in a single transaction; rows whose key was ingested before are skipped.
+
+    Returns a summary with one {key, detection_id, status} entry per row, in upload order.
+    """
+    for attempt in range(attempts):
+        try:
+            with metrics.span('ingest'):
+                existing, inserted = _insert(login_id, rows)
+                db.session.commit()
+            break
+        except IntegrityError:
+            # Another upload stored one of the keys first; the retry sees it as a duplicate
+            db.session.rollback()
+            if attempt == attempts - 1:
+                raise
+
+    created = iter(inserted)
+    stored = dict(existing)
+    results = []
+    for row in rows:
+        key = row['key']
+        if key is not None and key in stored:
+            results.append({'key': key, 'detection_id': stored[key], 'status': 'duplicate'})
+            continue
+        _, detection_id = next(created)
+        if key is not None:
+            stored[key] = detection_id
+        results.append({'key': key, 'detection_id': detection_id, 'status': 'created'})
+    return {
+        'received': len(rows),
+        'created': len(inserted),
+        'duplicates': len(rows) - len(inserted),
+        'results': results,
+    }
@@ -0,0 +1,215 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, select, update
+
+from detect import save_last_result
+from exports import write_export
+from models import db, DetectionJob
+from parallel import get_processor
+from registry import registry
+from result_cache import result_cache
+from series import new_series
+from video import SamplingPolicy, demo_video_path
+
+
+def run_detection(app, video_path, sampling, login_id, progress=None, on_detection=None, batch_size=None,
+                  annotate=False):
+    """Detects a video (or reuses cached counts) and records the last frame's counts as a Detection.
+
+    Shared by /detect, background jobs and SSE streams. on_detection(detection) is called for every analyzed frame,
+    which keeps the run in this process; df.attrs['cached'] tells whether the counts came from the result cache.
+    """
+    model_path, class_names = app.config['MODEL_PATH'], app.config['CLASS_NAMES']
+    batch_size = batch_size or app.config['DETECT_BATCH_SIZE']
+
+    # Same video, model, classes and sampling -> reuse the stored counts; the Detection row is still recorded
+    cache_key = None
+    if app.config.get('RESULT_CACHE_ENABLED', True):
+        cache_key = result_cache.key(video_path, model_path, class_names, sampling, registry.variant,
+                                     registry.preprocess)
+        series = result_cache.get(cache_key)
+        if series is not None:
+            df = save_last_result(series, login_id)
+            df.attrs['cached'] = True
+            return df
+
+    series = new_series(class_names)
+    try:
+        # Shard across processes when DETECT_PROCESSES > 1, otherwise use the shared in-process model.
+        # Tracking and early exit stay sequential: track IDs don't carry across segments, and segments can't stop
+        # early, so sharding would analyze the frames early exit is there to skip
+        processes = app.config.get('DETECT_PROCESSES', 1)
+        if processes > 1 and not sampling.tracker and not sampling.stable_frames and on_detection is None:
+            processor = get_processor(model_path, class_names, processes, registry.backend, registry.precision,
+                                      registry.preprocess, registry.export_dir, registry.calibration_data)
+            processor.detect(video_path, batch_size=batch_size, sampling=sampling, progress=progress, series=series)
+        else:
+            with registry.detector(model_path, class_names) as detector:
+                detector.detect(video_path, batch_size=batch_size, sampling=sampling, progress=progress,
+                                series=series, on_detection=on_detection, annotate=annotate)
+        series.close()
+
+        df = save_last_result(series, login_id)
+        if cache_key is not None:
+            result_cache.put(cache_key, series)
+        df.attrs['cached'] = False
+        return df
+    finally:
+        series.discard()
+
+
+class JobRunner:
+    """Runs detection jobs on local worker threads; job state lives in the database.
+
+    Several processes may serve the app (gunicorn workers): a job is claimed with one conditional UPDATE, so only
+    one of them runs it, and a running job whose heartbeat goes stale (its process died) is queued again.
+    """
+
+    def __init__(self, max_workers=1, progress_interval=1.0, lease=120, heartbeat_interval=15):
+        self.max_workers = max_workers
+        self.progress_interval = progress_interval  # seconds between progress writes
+        self.lease = lease  # seconds without a heartbeat before a running job is requeued
+        self.heartbeat_interval = heartbeat_interval
+        self.app = None
+        self.worker_id = None
+        self._executor = None
+        self._pending = set()  # job ids submitted to this process's executor and not finished yet
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config.get('DETECT_WORKERS', self.max_workers)
+        self.lease = app.config.get('JOB_LEASE_SECONDS', self.lease)
+        app.extensions['job_runner'] = self
+        # Started by the first request rather than here, so processes that only build the app (seed.py, the
+        # reloader's parent process) never run jobs
+        app.before_request(self.start)
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            # Set here, after any fork, so every serving process has its own id
+            self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+            # Threads rather than processes: the models in registry are per process
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='detect-job')
+        threading.Thread(target=self._heartbeat_loop, daemon=True, name='detect-job-heartbeat').start()
+
+        # Jobs left behind by a restart are picked up again
+        with self.app.app_context():
+            self._recover()
+
+    def submit(self, login_id, tool_source, sampling=None):
+        self.start()
+        sampling = sampling or SamplingPolicy()
+        job = DetectionJob(login_id=login_id, tool_source=tool_source, sampling=json.dumps(sampling.to_dict()))
+        db.session.add(job)
+        db.session.commit()
+        self._submit(job.id)
+        return job
+
+    def _submit(self, job_id):
+        with self._lock:
+            if job_id in self._pending:
+                return
+            self._pending.add(job_id)
+        self._executor.submit(self._run, job_id)
+
+    def _recover(self):
+        expired = datetime.utcnow() - timedelta(seconds=self.lease)
+        db.session.execute(
+            update(DetectionJob)
+            .where(DetectionJob.status == 'running',
+                   or_(DetectionJob.heartbeat.is_(None), DetectionJob.heartbeat < expired))
+            .values(status='queued', claimed_by=None)
+        )
+        db.session.commit()
+        # Other processes may try the same queued jobs; _claim lets only one of them run each
+        for job_id in db.session.scalars(select(DetectionJob.id).where(DetectionJob.status == 'queued')):
+            self._submit(job_id)
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            try:
+                with self.app.app_context():
+                    db.session.execute(
+                        update(DetectionJob)
+                        .where(DetectionJob.claimed_by == self.worker_id, DetectionJob.status == 'running')
+                        .values(heartbeat=datetime.utcnow())
+                    )
+                    db.session.commit()
+                    self._recover()
+            except Exception as e:
+                print(f"Job heartbeat failed: {e}")
+
+    def _claim(self, job_id):
+        # Atomic: of all the processes trying this job, exactly one sees rowcount 1
+        result = db.session.execute(
+            update(DetectionJob)
+            .where(DetectionJob.id == job_id, DetectionJob.status == 'queued')
+            .values(status='running', claimed_by=self.worker_id, heartbeat=datetime.utcnow())
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                if self._claim(job_id):
+                    self._run_claimed(db.session.get(DetectionJob, job_id))
+        finally:
+            with self._lock:
+                self._pending.discard(job_id)
+
+    def _run_claimed(self, job):
+        last_write = [0.0]
+
+        def progress(frames_done, frames_total):
+            now = time.monotonic()
+            if now - last_write[0] >= self.progress_interval:
+                job.frames_done = frames_done
+                job.frames_total = frames_total
+                db.session.commit()
+                last_write[0] = now
+
+        try:
+            video_path = demo_video_path(job.tool_source)
+            if not os.path.exists(video_path):
+                raise FileNotFoundError(f"Video {video_path} not found")
+
+            sampling = SamplingPolicy.from_dict(json.loads(job.sampling or '{}'))
+            df = run_detection(self.app, video_path, sampling, job.login_id, progress)
+
+            job.result = json.dumps(df.to_dict(orient="records"))
+            job.detection_id = df.attrs.get('detection_id')
+            job.frames_done = job.frames_total
+            job.status = 'done'
+            self._write_exports(job.detection_id)
+        except Exception as e:
+            db.session.rollback()
+            job.status = 'failed'
+            job.error = str(e)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+    def _write_exports(self, detection_id):
+        # Downloads are prepared here, off the request thread; a failure only costs the pre-built file
+        if detection_id is None:
+            return
+        for fmt in self.app.config.get('JOB_EXPORT_FORMATS', ()):
+            try:
+                write_export(detection_id, fmt)
+            except Exception as e:
+                print(f"Export {fmt} for detection {detection_id} failed: {e}")
+
+
+job_runner = JobRunner()
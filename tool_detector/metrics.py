@@ -0,0 +1,142 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import Response, abort, g, has_request_context, request, template_rendered, before_render_template
+from flask_login import current_user
+from sqlalchemy import event
+
+# Seconds; wide enough for a single SQL query up to a whole video
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label combination."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for key, series in sorted(snapshot.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", "+Inf")])} {series[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(labels)} {series[-2]}')
+            lines.append(f'{self.name}_count{_format_labels(labels)} {series[-1]}')
+        return '\n'.join(lines)
+
+
+class Metrics:
+    """Histograms for the detection pipeline and the Flask views, served as Prometheus text on /metrics.
+
+    Detection running in ParallelVideoProcessor workers is timed in those processes and isn't reported here.
+    """
+
+    def __init__(self):
+        self.stages = Histogram('tool_detector_stage_seconds',
+                                'Time spent per detection pipeline stage (inference is per batch).', ['stage'])
+        self.requests = Histogram('tool_detector_request_seconds', 'Flask request duration.',
+                                  ['endpoint', 'method', 'status'])
+        self.queries = Histogram('tool_detector_sql_query_seconds', 'SQL statement duration.', ['endpoint'])
+        self.templates = Histogram('tool_detector_template_render_seconds', 'Jinja template rendering time.',
+                                   ['template'])
+        self.token = None
+
+    def span(self, stage):
+        return self.stages.time(stage=stage)
+
+    def init_app(self, app, engine):
+        self.token = app.config.get('METRICS_TOKEN')
+        app.extensions['metrics'] = self
+
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        before_render_template.connect(self._start_template, app)
+        template_rendered.connect(self._end_template, app)
+        event.listen(engine, 'before_cursor_execute', self._start_query)
+        event.listen(engine, 'after_cursor_execute', self._end_query)
+
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def view(self):
+        # Logged-in users can look; scrapers can't log in, so they send the METRICS_TOKEN bearer token instead
+        scraper = bool(self.token) and request.headers.get('Authorization') == f'Bearer {self.token}'
+        if not scraper and not current_user.is_authenticated:
+            abort(403)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def render(self):
+        return '\n'.join(h.render() for h in (self.stages, self.requests, self.queries, self.templates)) + '\n'
+
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+
+    def _end_request(self, response):
+        started = g.pop('metrics_started', None)
+        # Streamed responses (SSE, MJPEG) are timed up to the first byte only
+        if started is not None and request.endpoint != 'metrics':
+            self.requests.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unmatched',
+                                  method=request.method, status=response.status_code)
+        return response
+
+    def _start_template(self, sender, template, context, **extra):
+        g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+    def _end_template(self, sender, template, context, **extra):
+        stack = g.get('metrics_templates')
+        if stack:
+            self.templates.observe(time.perf_counter() - stack.pop(), template=template.name)
+
+    def _start_query(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def _end_query(self, conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get('metrics_started')
+        if stack:
+            endpoint = (request.endpoint or 'unmatched') if has_request_context() else 'background'
+            self.queries.observe(time.perf_counter() - stack.pop(), endpoint=endpoint)
+
+
+metrics = Metrics()
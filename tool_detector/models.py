@@ -1,7 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.schema import CreateColumn, CreateIndex
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import json
 
 db = SQLAlchemy()
 
@@ -12,6 +15,11 @@ class Role(db.Model):
     description = db.Column(db.String(255))
     permissions = db.Column(db.String(255))
 
+    # Case-insensitive name search and keyset pages of the role list (see pagination.py)
+    __table_args__ = (
+        db.Index('ix_roles_name_lower', db.func.lower(name)),
+    )
+
     def has_perm(self, code: str) -> bool:
         if not self.permissions:
             return False
@@ -27,6 +35,13 @@ class User(UserMixin, db.Model):
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))
     role = db.relationship('Role', backref='users')
 
+    # Keyset pages of the user list (see pagination.py); email is already indexed by its unique constraint
+    __table_args__ = (
+        db.Index('ix_users_name_lower', db.func.lower(name)),
+        db.Index('ix_users_role_email', 'role_id', 'email'),
+        db.Index('ix_users_role_name_lower', role_id, db.func.lower(name)),
+    )
+
     def set_password(self, password: str):
         self.password_hash = generate_password_hash(password)
 
@@ -37,8 +52,16 @@ class User(UserMixin, db.Model):
     def is_active(self) -> bool:  # Flask-Login uses this to gate login sessions
         return self.active
     
+TOOL_COLUMNS = ['drill', 'hammer', 'pliers', 'scissors', 'screwdriver', 'tape_measure', 'wrench']
+
 class Detection(db.Model):
     __tablename__ = 'detections'
+    __table_args__ = (
+        db.Index('ix_detections_login_created', 'login_id', 'created_at'),
+        # History filtered by tool: partial indexes keep those pages from scanning past rows without the tool
+        *(db.Index(f'ix_detections_{col}_login_created', 'login_id', 'created_at', sqlite_where=db.text(f'{col} > 0'))
+          for col in TOOL_COLUMNS),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     login_id = db.Column(db.String(64), nullable=False)
@@ -52,4 +75,98 @@ class Detection(db.Model):
     tape_measure = db.Column(db.Integer, default=0)  # renamed from tape-measure
     wrench = db.Column(db.Integer, default=0)
 
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DetectionDaily(db.Model):
+    # Per-user, per-day totals of Detection, kept up to date on every flush (see reports.py)
+    __tablename__ = 'detection_daily'
+
+    login_id = db.Column(db.String(64), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    detections = db.Column(db.Integer, default=0, nullable=False)
+
+    drill = db.Column(db.Integer, default=0, nullable=False)
+    hammer = db.Column(db.Integer, default=0, nullable=False)
+    pliers = db.Column(db.Integer, default=0, nullable=False)
+    scissors = db.Column(db.Integer, default=0, nullable=False)
+    screwdriver = db.Column(db.Integer, default=0, nullable=False)
+    tape_measure = db.Column(db.Integer, default=0, nullable=False)
+    wrench = db.Column(db.Integer, default=0, nullable=False)
+
+class DetectionIngestKey(db.Model):
+    # Client-supplied keys of bulk-ingested detections, so a retried upload doesn't insert twice (see ingest.py)
+    __tablename__ = 'detection_ingest_keys'
+
+    login_id = db.Column(db.String(64), primary_key=True)
+    client_key = db.Column(db.String(128), primary_key=True)
+    detection_id = db.Column(db.Integer, nullable=False)
+
+class DetectionJob(db.Model):
+    __tablename__ = 'detection_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    login_id = db.Column(db.String(64), nullable=False)
+    tool_source = db.Column(db.String(255), nullable=False)
+    sampling = db.Column(db.Text)  # JSON of the SamplingPolicy
+
+    status = db.Column(db.String(16), default='queued', nullable=False)  # queued / running / done / failed
+    claimed_by = db.Column(db.String(128))  # process running the job, see JobRunner._claim
+    heartbeat = db.Column(db.DateTime)  # refreshed while running; a stale one means the process died
+    frames_done = db.Column(db.Integer, default=0)
+    frames_total = db.Column(db.Integer, default=0)
+    result = db.Column(db.Text)  # JSON list of result rows
+    detection_id = db.Column(db.Integer)  # Detection row written when the job finished
+    error = db.Column(db.Text)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tool_source': self.tool_source,
+            'status': self.status,
+            'frames_done': self.frames_done or 0,
+            'frames_total': self.frames_total or 0,
+            'result': json.loads(self.result) if self.result else None,
+            'detection_id': self.detection_id,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+def configure_sqlite(engine):
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')  # readers (/report) don't block on writers and vice versa
+        # With WAL, NORMAL fsyncs only at checkpoints: the database stays consistent, and survives an app crash, but the
+        # last commits can be rolled back after a power loss or OS crash
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=5000')  # wait for a competing writer instead of failing at once
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA cache_size=-20000')  # ~20 MB page cache per connection
+        cursor.close()
+
+def ensure_columns():
+    # create_all() doesn't alter existing tables; nullable columns added later are appended here
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=conn.dialect)}')
+
+def ensure_indexes():
+    # create_all() skips tables that already exist, so indexes added later are created here.
+    # IF NOT EXISTS rather than checkfirst, which can't see expression indexes like ix_users_name_lower on SQLite
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
\ No newline at end of file
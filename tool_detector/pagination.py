@@ -0,0 +1,86 @@
+import base64
+import json
+import sys
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, String, tuple_
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+
+class Page:
+    def __init__(self, items, next_cursor, per_page):
+        self.items = items
+        self.next_cursor = next_cursor  # None on the last page
+        self.per_page = per_page
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def _decode_value(column, value):
+    # Cursors come from the client, so each value must match its column's type before it is bound
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, Integer):
+        expected = int
+    elif isinstance(column.type, String):
+        expected = str
+    else:
+        expected = (str, int, float)
+    if not isinstance(value, expected) or isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:  # SQLite integers are 64-bit
+        raise ValueError
+    return value
+
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [_decode_value(c, v) for c, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise ValueError("Invalid page cursor")
+
+
+def _next_char(char):
+    # Surrogates can't be stored as UTF-8, so the character after U+D7FF is U+E000
+    code = ord(char) + 1
+    return chr(0xE000 if 0xD800 <= code <= 0xDFFF else code)
+
+
+def prefix_filter(column, prefix):
+    # A range instead of LIKE 'x%' so SQLite can seek on the index: prefix <= value < prefix with its last char bumped
+    condition = column >= prefix
+    stem = prefix.rstrip(chr(sys.maxunicode))  # U+10FFFF can't be bumped; bump the character before it
+    if stem:
+        condition &= column < stem[:-1] + _next_char(stem[-1])
+    return condition
+
+
+def per_page_arg(args):
+    per_page = args.get('per_page', DEFAULT_PER_PAGE, type=int)
+    return max(1, min(per_page or DEFAULT_PER_PAGE, MAX_PER_PAGE))
+
+
+def keyset_page(query, columns, cursor=None, per_page=DEFAULT_PER_PAGE, descending=False):
+    """One page of query ordered by columns (the last one unique), continuing after cursor.
+
+    Each page seeks straight past the previous page's last row instead of using OFFSET, so with an index on
+    (filters..., columns...) a page costs the same on the first page as on the thousandth.
+    """
+    if cursor:
+        after = decode_cursor(cursor, columns)
+        key = tuple_(*columns)
+        query = query.filter(key < tuple_(*after) if descending else key > tuple_(*after))
+    order = [column.desc() if descending else column for column in columns]
+
+    # One extra row tells whether there is a next page
+    rows = query.add_columns(*columns).order_by(*order).limit(per_page + 1).all()
+    next_cursor = encode_cursor(rows[per_page - 1][1:]) if len(rows) > per_page else None
+    return Page([row[0] for row in rows[:per_page]], next_cursor, per_page)
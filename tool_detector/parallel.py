@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from flask_login import current_user
+
+from backends import export_model
+from detect import ToolDetector, save_last_result
+from series import FrameSeries
+from video import Preprocessor, SamplingPolicy, probe
+
+# Set in each worker process by _init_worker
+_worker_detector = None
+
+
+def _init_worker(model_path, class_names, threads, backend, precision, preprocess, export_dir, data):
+    global _worker_detector
+    # threads: share the cores between workers instead of oversubscribing
+    _worker_detector = ToolDetector(model_path, class_names, backend=backend, precision=precision, threads=threads,
+                                    preprocess=Preprocessor.from_dict(preprocess), export_dir=export_dir, data=data)
+
+
+def _process_segment(video_path, start_frame, stop_frame, sampling, batch_size):
+    # Early exit is applied after merging, so every segment runs to its end
+    sampling = SamplingPolicy.from_dict(dict(sampling, stable_frames=None))
+    return [
+        (detection.frame_num, detection.counts)
+        for detection in _worker_detector.iter_detections(video_path, batch_size, sampling=sampling,
+                                                          start_frame=start_frame, stop_frame=stop_frame)
+    ]
+
+
+def _apply_stable_exit(frame_counts, stable_frames):
+    # Cut the merged (frame_num, counts) list where the sequential path would have stopped
+    if not stable_frames:
+        return frame_counts
+    stable, last_counts = 0, None
+    for i, (_, counts) in enumerate(frame_counts):
+        stable = stable + 1 if counts == last_counts else 1
+        last_counts = counts
+        if stable >= stable_frames:
+            return frame_counts[:i + 1]
+    return frame_counts
+
+
+class ParallelVideoProcessor:
+    """Splits a video into time segments and runs them on a pool of processes, one model per process."""
+
+    def __init__(self, model_path, class_names, workers=None, backend='torch', precision='fp32', preprocess=None,
+                 export_dir=None, data=None):
+        self.model_path = model_path
+        self.class_names = class_names
+        self.workers = workers or os.cpu_count() or 1
+        self.backend = backend
+        self.precision = precision
+        self.preprocess = preprocess or Preprocessor()
+        self.export_dir = export_dir  # where ONNX / OpenVINO exports go, like INFERENCE_EXPORT_DIR
+        self.data = data  # calibration dataset for OpenVINO INT8
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            # Export once here rather than racing to do it in every worker
+            export_model(self.model_path, self.backend, self.precision, self.export_dir, data=self.data)
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            # spawn: forking a process that already runs torch and Flask threads is not safe
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker,
+                                             initargs=(self.model_path, self.class_names, threads,
+                                                       self.backend, self.precision, self.preprocess.to_dict(),
+                                                       self.export_dir, self.data))
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def segments(self, video_path, sampling):
+        fps, frame_count = probe(video_path)
+        if not fps or fps <= 0:
+            raise ValueError("Could not retrieve FPS from video.")
+        first = sampling.start_frame(fps, frame_count)
+        length = max(frame_count - first, 0)
+        size = max(1, -(-length // self.workers))  # ceil division
+        # The frame count is only an estimate in some containers, so it splits the earlier segments and the last one
+        # reads until decoding fails, like the sequential path
+        starts = list(range(first, frame_count, size)) or [first]
+        return [(start, stop) for start, stop in zip(starts, starts[1:] + [None])]
+
+    def detect(self, video_path, batch_size=8, sampling=None, progress=None, series=None):
+        sampling = sampling or SamplingPolicy()
+        if sampling.tracker:
+            raise ValueError("Tracking needs the whole video in one pass and can't be split across processes")
+        segments = self.segments(video_path, sampling)
+        frame_total = probe(video_path)[1]
+        frames_done = segments[0][0]
+        pool = self._get_pool()
+
+        futures = {
+            pool.submit(_process_segment, video_path, start, stop, sampling.to_dict(), batch_size): (start, stop)
+            for start, stop in segments
+        }
+        results = {}
+        for future in as_completed(futures):
+            start, stop = futures[future]
+            results[start] = future.result()
+            frames_done += (stop if stop is not None else max(frame_total, start)) - start
+            if progress:
+                progress(frames_done, frame_total)
+
+        # Segments are merged back in video order
+        merged = [row for start in sorted(results) for row in results[start]]
+        frame_counts = series if series is not None else FrameSeries(self.class_names)
+        for frame_num, counts in _apply_stable_exit(merged, sampling.stable_frames):
+            frame_counts.append(frame_num, counts)
+        frame_counts.flush()
+        return frame_counts
+
+    def process_video(self, video_path, batch_size=8, sampling=None, login_id=None, progress=None):
+        if login_id is None:
+            login_id = str(current_user.id)
+        frame_counts = self.detect(video_path, batch_size, sampling, progress)
+        return save_last_result(frame_counts, login_id)
+
+
+_processors = {}
+
+
+def get_processor(model_path, class_names, workers, backend='torch', precision='fp32', preprocess=None,
+                  export_dir=None, data=None):
+    # One long-lived pool per model, so workers load the weights once
+    preprocess = preprocess or Preprocessor()
+    key = (model_path, tuple(class_names), workers, backend, precision, preprocess.input_size, preprocess.roi,
+           export_dir, data)
+    if key not in _processors:
+        _processors[key] = ParallelVideoProcessor(model_path, class_names, workers, backend, precision, preprocess,
+                                                  export_dir, data)
+    return _processors[key]
@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+from flask_login import current_user
+
+
+class SamplingProfiler:
+    """Samples one thread's stack at a fixed interval and aggregates it as collapsed stacks (flamegraph input)."""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        # One "frame;frame;frame count" line per distinct stack, as flamegraph.pl / speedscope read it
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def profile_dir():
+    directory = current_app.config.get('PROFILE_DIR') or os.path.join(current_app.instance_path, 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+class RequestProfiler:
+    """Opt-in per-request sampling: set PROFILER_ENABLED, then admins add ?profile=1 (or X-Profile: 1)."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.enabled = False
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PROFILER_ENABLED', False)
+        self.interval = app.config.get('PROFILER_INTERVAL', self.interval)
+        app.extensions['request_profiler'] = self
+        app.before_request(self._start)
+        app.after_request(self._end)
+
+    def _wanted(self):
+        if not self.enabled:
+            return False
+        if request.args.get('profile') != '1' and request.headers.get('X-Profile') != '1':
+            return False
+        return current_user.is_authenticated and current_user.role is not None and current_user.role.name == 'admin'
+
+    def _start(self):
+        if self._wanted():
+            g.profiler = SamplingProfiler(threading.get_ident(), self.interval).start()
+
+    def _end(self, response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        # Streamed responses are only profiled until the view returns
+        profiler.stop()
+        name = f"{datetime.utcnow():%Y%m%d-%H%M%S-%f}-{request.endpoint or 'unmatched'}.txt"
+        with open(os.path.join(profile_dir(), name), 'w') as f:
+            f.write(profiler.collapsed())
+        response.headers['X-Profile'] = f'{name} ({profiler.samples} samples)'
+        return response
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,117 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from backends import check_variant, load_model, variant_name
+from detect import ToolDetector
+from video import Preprocessor
+
+CAMERA_FRAME_SHAPE = (720, 1280, 3)  # typical source frame, before preprocessing
+
+
+class _LoadedModel:
+    def __init__(self, model):
+        self.model = model
+        # ultralytics predictors keep per-call state, so one inference call at a time per model
+        self.lock = threading.Lock()
+
+
+class ModelRegistry:
+    """Keeps YOLO models loaded once per worker process, evicting the least recently used."""
+
+    def __init__(self, max_models=2, warmup_shape=CAMERA_FRAME_SHAPE, backend='torch', precision='fp32', threads=None):
+        self.max_models = max_models
+        self.warmup_shape = warmup_shape
+        self.backend = backend
+        self.precision = precision
+        self.threads = threads  # intra-op threads; None keeps the runtime default
+        self.export_dir = None
+        self.calibration_data = None
+        self.preprocess = Preprocessor()
+        self._models = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_models = app.config.get('MODEL_CACHE_SIZE', self.max_models)
+        self.backend = app.config.get('INFERENCE_BACKEND', self.backend)
+        self.precision = app.config.get('INFERENCE_PRECISION', self.precision)
+        self.threads = app.config.get('INFERENCE_THREADS', self.threads)
+        self.export_dir = app.config.get('INFERENCE_EXPORT_DIR')
+        self.calibration_data = app.config.get('INFERENCE_CALIBRATION_DATA')
+        check_variant(self.backend, self.precision)
+        self.preprocess = Preprocessor(app.config.get('DETECT_INPUT_SIZE', 640),
+                                       Preprocessor.parse_roi(app.config.get('DETECT_ROI')))
+        # Warm up on what a camera frame becomes after the ROI crop and resize, i.e. the shape inference really sees
+        self.warmup_shape = self.preprocess(np.zeros(CAMERA_FRAME_SHAPE, dtype=np.uint8)).shape
+        app.extensions['model_registry'] = self
+
+        # Warm the default model at startup so the first /detect doesn't pay for it
+        model_path = app.config.get('MODEL_PATH')
+        if app.config.get('MODEL_PRELOAD', True) and model_path and os.path.exists(model_path):
+            self.preload(model_path)
+
+    @property
+    def variant(self):
+        return variant_name(self.backend, self.precision)
+
+    def preload(self, model_path):
+        self._get(model_path)
+
+    def loaded(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def evict(self, model_path):
+        with self._lock:
+            for key in [key for key in self._models if key[0] == model_path]:
+                self._models.pop(key)
+
+    @contextmanager
+    def detector(self, model_path, class_names):
+        # Detectors share the model; each infer / infer_batch call takes its lock, so concurrent videos interleave
+        entry = self._get(model_path)
+        yield ToolDetector(model_path, class_names, model=entry.model, preprocess=self.preprocess, lock=entry.lock)
+
+    def new_detector(self, model_path, class_names):
+        # A private model instance, outside the cache, for a caller that can't wait behind shared use
+        return ToolDetector(model_path, class_names, model=self._load(model_path, self.backend, self.precision),
+                            preprocess=self.preprocess)
+
+    def _get(self, model_path):
+        # The same weights on another backend or precision are a separate model
+        key = (model_path, self.backend, self.precision)
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                self._models.move_to_end(key)
+                return entry
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so a slow load doesn't block other models
+        with load_lock:
+            with self._lock:
+                entry = self._models.get(key)
+                if entry is not None:
+                    self._models.move_to_end(key)
+                    return entry
+
+            entry = _LoadedModel(self._load(*key))
+
+            with self._lock:
+                self._models[key] = entry
+                self._loading.pop(key, None)
+                while len(self._models) > self.max_models:
+                    self._models.popitem(last=False)
+        return entry
+
+    def _load(self, model_path, backend, precision):
+        # Exports to ONNX / OpenVINO on first use; later loads reuse the cached export
+        return load_model(model_path, backend, precision, self.threads, self.warmup_shape,
+                          export_dir=self.export_dir, data=self.calibration_data)
+
+
+registry = ModelRegistry()
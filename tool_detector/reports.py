@@ -0,0 +1,119 @@
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import event, func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models import db, Detection, DetectionDaily, TOOL_COLUMNS
+
+
+def _rollup_upsert(login_id, day, values, sign=1):
+    row = {'login_id': login_id, 'day': day, 'detections': sign * values.get('detections', 1)}
+    row.update({col: sign * (values.get(col) or 0) for col in TOOL_COLUMNS})
+    stmt = insert(DetectionDaily).values(**row)
+    # Concurrent writers for the same day add onto the existing row instead of racing to create it
+    return stmt.on_conflict_do_update(
+        index_elements=['login_id', 'day'],
+        set_={col: getattr(DetectionDaily, col) + stmt.excluded[col] for col in ['detections'] + TOOL_COLUMNS},
+    )
+
+
+def apply_rollups(connection, rows, sign=1):
+    # rows: dicts with login_id, created_at and the tool columns; one upsert per user and day, however many rows
+    days = {}
+    for row in rows:
+        created_at = row.get('created_at') or datetime.utcnow()
+        totals = days.setdefault((row['login_id'], created_at.date()), dict.fromkeys(['detections'] + TOOL_COLUMNS, 0))
+        totals['detections'] += 1
+        for col in TOOL_COLUMNS:
+            totals[col] += row.get(col) or 0
+    for (login_id, day), totals in days.items():
+        connection.execute(_rollup_upsert(login_id, day, totals, sign))
+
+
+def _detection_row(detection):
+    row = {col: getattr(detection, col) for col in TOOL_COLUMNS}
+    row['login_id'] = detection.login_id
+    row['created_at'] = detection.created_at
+    return row
+
+
+@event.listens_for(Session, 'before_flush')
+def _stamp_new_detections(session, flush_context, instances):
+    # The rollup needs the day before the INSERT runs
+    for obj in session.new:
+        if isinstance(obj, Detection) and obj.created_at is None:
+            obj.created_at = datetime.utcnow()
+
+
+@event.listens_for(Session, 'after_flush')
+def _maintain_rollups(session, flush_context):
+    added = [_detection_row(obj) for obj in session.new if isinstance(obj, Detection)]
+    removed = [_detection_row(obj) for obj in session.deleted if isinstance(obj, Detection)]
+    if added or removed:
+        connection = session.connection()
+        apply_rollups(connection, added)
+        apply_rollups(connection, removed, sign=-1)
+
+
+def rebuild_rollups():
+    DetectionDaily.query.delete()
+    day = func.date(Detection.created_at)
+    totals = db.session.query(
+        Detection.login_id, day, func.count(Detection.id), *[func.sum(getattr(Detection, col)) for col in TOOL_COLUMNS]
+    ).group_by(Detection.login_id, day)
+    for login_id, day_value, count, *sums in totals:
+        db.session.add(DetectionDaily(
+            login_id=login_id,
+            day=datetime.strptime(day_value, '%Y-%m-%d').date(),
+            detections=count,
+            **{col: value or 0 for col, value in zip(TOOL_COLUMNS, sums)},
+        ))
+    db.session.commit()
+
+
+def ensure_rollups():
+    # Databases created before the rollup table existed are backfilled once
+    if DetectionDaily.query.first() is None and Detection.query.first() is not None:
+        rebuild_rollups()
+
+
+def _raw_totals(login_id, start_dt, end_dt):
+    query = db.session.query(*[func.sum(getattr(Detection, col)) for col in TOOL_COLUMNS]) \
+        .filter(Detection.login_id == login_id)
+    if start_dt:
+        query = query.filter(Detection.created_at >= start_dt)
+    if end_dt:
+        query = query.filter(Detection.created_at < end_dt)
+    return query.first()
+
+
+def _rollup_totals(login_id, start_day, end_day):
+    query = db.session.query(*[func.sum(getattr(DetectionDaily, col)) for col in TOOL_COLUMNS]) \
+        .filter(DetectionDaily.login_id == login_id)
+    if start_day:
+        query = query.filter(DetectionDaily.day >= start_day)
+    if end_day:
+        query = query.filter(DetectionDaily.day < end_day)
+    return query.first()
+
+
+def report_totals(login_id, start_dt=None, end_dt=None):
+    """Tool totals for [start_dt, end_dt): whole days come from the rollups, partial days from raw rows."""
+    first_day = start_dt.date() if start_dt else None
+    if start_dt and start_dt.time() != time.min:
+        first_day += timedelta(days=1)
+    end_day = end_dt.date() if end_dt else None
+
+    parts = []
+    if first_day and end_day and first_day >= end_day:
+        # The whole range sits inside a single day
+        parts.append(_raw_totals(login_id, start_dt, end_dt))
+    else:
+        parts.append(_rollup_totals(login_id, first_day, end_day))
+        if start_dt and start_dt.time() != time.min:
+            parts.append(_raw_totals(login_id, start_dt, datetime.combine(first_day, time.min)))
+        if end_dt and end_dt.time() != time.min:
+            parts.append(_raw_totals(login_id, datetime.combine(end_day, time.min), end_dt))
+
+    return {col: sum(part[i] or 0 for part in parts) for i, col in enumerate(TOOL_COLUMNS)}
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from series import FrameSeries
+
+
+class ResultCache:
+    """On-disk cache of per-frame detection counts, keyed by what went into producing them."""
+
+    def __init__(self, directory=None, max_entries=256, max_age=7 * 24 * 3600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_age = max_age  # seconds since last use
+        self._digests = {}  # path -> ((size, mtime), sha256) so unchanged files are hashed once
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = app.config.get('RESULT_CACHE_DIR') or os.path.join(app.instance_path, 'result_cache')
+        self.max_entries = app.config.get('RESULT_CACHE_MAX_ENTRIES', self.max_entries)
+        self.max_age = app.config.get('RESULT_CACHE_MAX_AGE', self.max_age)
+        os.makedirs(self.directory, exist_ok=True)
+        app.extensions['result_cache'] = self
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        with self._lock:
+            self._digests[path] = (signature, digest.hexdigest())
+        return digest.hexdigest()
+
+    def key(self, video_path, model_path, class_names, sampling, variant='torch-fp32', preprocess=None):
+        parts = {
+            'video': self.file_digest(video_path),
+            'model': self.file_digest(model_path),
+            'variant': variant,  # quantized backends may count differently
+            'classes': list(class_names),
+            'sampling': sampling.to_dict(),
+            'preprocess': preprocess.to_dict() if preprocess else None,  # input size and ROI change the counts
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                return None
+            series = FrameSeries.open(path)
+        except (OSError, ValueError):
+            return None
+
+        os.utime(path)  # mtime doubles as last-used time for eviction
+        return series
+
+    def put(self, key, series):
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        series.copy_to(tmp_path)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if now - mtime > self.max_age:
+                self._remove(path)
+            else:
+                entries.append((mtime, path))
+
+        # Least recently used entries go first
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            self._remove(path)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                self._remove(os.path.join(self.directory, name))
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+result_cache = ResultCache()
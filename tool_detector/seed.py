@@ -5,7 +5,8 @@ ADMIN_ROLE = 'admin'
 USER_ROLE = 'user'
 
 def main():
-    app = create_app()
+    # Only the database is needed here, not the model
+    app = create_app({'MODEL_PRELOAD': False})
    
     with app.app_context():
         db.create_all()
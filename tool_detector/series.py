@@ -0,0 +1,165 @@
+import os
+import shutil
+import struct
+import tempfile
+
+import numpy as np
+from flask import current_app
+
+COUNT_DTYPE = np.uint16
+_MAGIC = b'\x93NUMPY\x01\x00'
+
+
+def series_dtype(class_names):
+    # One small integer column per class, plus the source frame number
+    return np.dtype([('frame', np.uint32)] + [(name, COUNT_DTYPE) for name in class_names])
+
+
+def _npy_header(dtype, rows, size=None):
+    text = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.lib.format.dtype_to_descr(dtype), rows)
+    if size is None:
+        # Leave room for the row count to grow, rounded to numpy's 64-byte alignment
+        size = -(-(len(_MAGIC) + 2 + len(text) + 1 + 20) // 64) * 64
+    text = text.ljust(size - len(_MAGIC) - 2 - 1) + '\n'
+    return _MAGIC + struct.pack('<H', len(text)) + text.encode('latin1')
+
+
+class FrameSeries:
+    """Per-frame class counts in a compact structured array, optionally streamed to an .npy file."""
+
+    def __init__(self, class_names, path=None, chunk_rows=1024):
+        self.class_names = list(class_names)
+        self.dtype = series_dtype(self.class_names)
+        self.path = path
+        self._buffer = np.zeros(chunk_rows, dtype=self.dtype)
+        self._pending = 0   # rows in the buffer not yet written
+        self._flushed = 0   # rows already in the file
+        self._last = None
+        self._file = None
+        self._header_size = 0
+        self._owned = path is not None  # a file we created ourselves can be moved instead of copied
+        if path is not None:
+            self._file = open(path, 'wb')
+            header = _npy_header(self.dtype, 0)
+            self._header_size = len(header)
+            self._file.write(header)
+
+    @classmethod
+    def open(cls, path):
+        # Read-only view over an existing series file
+        array = np.load(path, mmap_mode='r')
+        series = cls([name for name in array.dtype.names if name != 'frame'])
+        series.path = path
+        series._flushed = len(array)
+        series._owned = False
+        if len(array):
+            series._last = series._row_to_counts(array[-1])
+        return series
+
+    def __len__(self):
+        return self._flushed + self._pending
+
+    def append(self, frame_num, counts):
+        if self._pending == len(self._buffer):
+            if self._file is not None:
+                self.flush()
+            else:
+                # In-memory series grow by doubling
+                self._buffer = np.resize(self._buffer, len(self._buffer) * 2)
+        row = self._buffer[self._pending]
+        row['frame'] = frame_num
+        for name in self.class_names:
+            row[name] = counts.get(name, 0)
+        self._pending += 1
+        self._last = dict(counts)
+
+    def last(self):
+        return self._last
+
+    def flush(self):
+        if self._file is None or not self._pending:
+            return
+        self._file.write(self._buffer[:self._pending].tobytes())
+        self._flushed += self._pending
+        self._pending = 0
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        # Now that the row count is known, patch it into the reserved header
+        self._file.seek(0)
+        self._file.write(_npy_header(self.dtype, self._flushed, self._header_size))
+        self._file.close()
+        self._file = None
+
+    def to_array(self):
+        if self.path is None:
+            return self._buffer[:self._pending].copy()
+        self.close()
+        return np.load(self.path, mmap_mode='r')
+
+    def __iter__(self):
+        for row in self.to_array():
+            yield self._row_to_counts(row)
+
+    def save(self, dest):
+        # Moves a temp file we own into place, otherwise writes a copy
+        if self._owned:
+            self.close()
+            os.replace(self.path, dest)
+            self.path, self._owned = dest, False
+        else:
+            self.copy_to(dest)
+
+    def copy_to(self, dest):
+        if self.path is None:
+            with open(dest, 'wb') as f:
+                np.save(f, self.to_array())
+            return
+        self.close()
+        shutil.copyfile(self.path, dest)
+
+    def discard(self):
+        self.close()
+        if self._owned and self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _row_to_counts(self, row):
+        counts = {name: int(row[name]) for name in self.class_names}
+        counts['total'] = sum(counts.values())
+        return counts
+
+
+def series_dir():
+    directory = current_app.config.get('SERIES_DIR') or os.path.join(current_app.instance_path, 'series')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def new_series(class_names):
+    # Streams to a temp file until the Detection row it belongs to exists
+    fd, path = tempfile.mkstemp(dir=series_dir(), suffix='.tmp')
+    os.close(fd)
+    return FrameSeries(class_names, path=path)
+
+
+def series_path(detection_id):
+    return os.path.join(series_dir(), f'{detection_id}.npy')
+
+
+def load_series(detection_id, start=None, stop=None):
+    # Memory-mapped, so only the requested slice is read from disk; returns (rows, total rows in the series)
+    path = series_path(detection_id)
+    if not os.path.exists(path):
+        return None
+    series = np.load(path, mmap_mode='r')
+    array = series[start:stop]
+    class_names = [name for name in array.dtype.names if name != 'frame']
+    rows = []
+    for row in array:
+        counts = {'frame': int(row['frame'])}
+        counts.update({name: int(row[name]) for name in class_names})
+        counts['total'] = sum(int(row[name]) for name in class_names)
+        rows.append(counts)
+    return rows, len(series)
@@ -0,0 +1,123 @@
+import threading
+import time
+
+import cv2
+
+from video import demo_video_path
+
+STREAM_SCHEMES = ('rtsp://', 'rtsps://', 'http://', 'https://')
+
+
+class CaptureSource:
+    """Where a station's frames come from: a demo file, a V4L2 device index or an RTSP/HTTP stream."""
+
+    def __init__(self, kind, target):
+        self.kind = kind  # 'file' / 'device' / 'stream'
+        self.target = target
+
+    @classmethod
+    def parse(cls, spec):
+        spec = (spec or '').strip()
+        if not spec:
+            raise ValueError("A capture source is required")
+        if spec.isdigit():
+            return cls('device', int(spec))
+        if spec.lower().startswith(STREAM_SCHEMES):
+            return cls('stream', spec)
+        # Files are still limited to demo/, as in /detect
+        return cls('file', demo_video_path(spec))
+
+    @property
+    def is_live(self):
+        return self.kind != 'file'
+
+    def open(self):
+        if self.kind == 'device':
+            cap = cv2.VideoCapture(self.target)
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # don't let the driver queue up stale frames
+        elif self.kind == 'stream':
+            cap = cv2.VideoCapture(self.target, cv2.CAP_FFMPEG)
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        else:
+            cap = cv2.VideoCapture(self.target)
+        return cap
+
+    def __str__(self):
+        return str(self.target)
+
+
+class LatestFrameGrabber:
+    """Reads a source continuously and keeps only the newest frame, so consumers never fall behind."""
+
+    def __init__(self, source, reconnect_delay=1.0, loop_files=True):
+        self.source = source
+        self.reconnect_delay = reconnect_delay
+        self.loop_files = loop_files  # replay files forever so they can stand in for a camera
+        self.dropped = 0
+        self.grabbed = 0
+        self.connected = False
+        self._frame = None
+        self._captured_at = None
+        self._seq = 0
+        self._consumed = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def read(self, timeout=1.0):
+        # Newest frame not returned before, or None on timeout
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq != self._consumed or self._stop.is_set(), timeout=timeout)
+            if self._seq == self._consumed:
+                return None, None
+            self._consumed = self._seq
+            return self._frame, self._captured_at
+
+    def _run(self):
+        while not self._stop.is_set():
+            cap = self.source.open()
+            if not cap.isOpened():
+                cap.release()
+                self._stop.wait(self.reconnect_delay)
+                continue
+
+            self.connected = True
+            # Files are paced at their own fps; live sources already deliver in real time
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            interval = 1.0 / fps if not self.source.is_live and fps and fps > 0 else 0
+            next_at = time.monotonic()
+            while not self._stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                with self._cond:
+                    if self._seq != self._consumed:
+                        self.dropped += 1  # the previous frame was never picked up
+                    self._frame = frame
+                    self._captured_at = time.monotonic()
+                    self._seq += 1
+                    self.grabbed += 1
+                    self._cond.notify_all()
+                if interval:
+                    next_at += interval
+                    self._stop.wait(max(0.0, next_at - time.monotonic()))
+            cap.release()
+            self.connected = False
+
+            if not self.source.is_live and not self.loop_files:
+                break
+            if self.source.is_live:
+                self._stop.wait(self.reconnect_delay)
@@ -0,0 +1,141 @@
+import threading
+import time
+from datetime import datetime
+
+from registry import registry
+from sources import LatestFrameGrabber
+from streaming import LiveRun
+
+
+class StationSession:
+    """Long-running detection loop for one tool-crib station, always working on the newest frame."""
+
+    def __init__(self, name, source, model_path, class_names, preview_width=640):
+        self.name = name
+        self.source = source
+        self.model_path = model_path
+        self.class_names = class_names
+        self.grabber = LatestFrameGrabber(source)
+        self.preview = LiveRun(login_id=None, preview_width=preview_width)  # MJPEG of the annotated frames
+        self.counts = None
+        self.updated_at = None
+        self.latency_ms = None  # capture -> counts
+        self.processed = 0
+        self.error = None
+        self._fps_window = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.grabber.start()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f'station-{self.name}')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.grabber.stop()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.preview.finish()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        # The station's own model instance, so its frames never queue behind /detect, jobs or streams
+        try:
+            detector = registry.new_detector(self.model_path, self.class_names)
+        except Exception as e:
+            self.error = f"Model failed to load: {e}"
+            self.grabber.stop()
+            return
+
+        while not self._stop.is_set():
+            frame, captured_at = self.grabber.read(timeout=0.5)
+            if frame is None:
+                continue
+            try:
+                frame = detector.preprocess(frame)
+                results = detector.infer(frame)
+                counts = detector.detect_and_count(frame, results)
+                if self.preview.viewers:
+                    detector.draw_boxes(frame, results)
+            except Exception as e:
+                self.error = str(e)
+                self._stop.wait(1.0)
+                continue
+
+            now = time.monotonic()
+            self.counts = counts
+            self.updated_at = datetime.utcnow()
+            self.latency_ms = round((now - captured_at) * 1000, 1)
+            self.processed += 1
+            self.error = None
+            self._fps_window = [t for t in self._fps_window if now - t < 5.0] + [now]
+            if self.preview.viewers:
+                self.preview.publish_frame(frame)
+
+    def status(self):
+        counts = self.counts or {}
+        # Frames over the time the last 5 s window actually covers, so a station that just started isn't under-reported
+        now = time.monotonic()
+        window = [t for t in self._fps_window if now - t < 5.0]
+        span = window[-1] - window[0] if window else 0.0
+        fps = round((len(window) - 1) / span, 2) if span > 0 else 0.0
+        return {
+            'name': self.name,
+            'source': str(self.source),
+            'running': self.running,
+            'connected': self.grabber.connected,
+            'counts': self.counts,
+            'missing': [name for name in self.class_names if not counts.get(name)] if self.counts else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'latency_ms': self.latency_ms,
+            'fps': fps,
+            'processed': self.processed,
+            'dropped': self.grabber.dropped,
+            'error': self.error,
+        }
+
+
+class StationManager:
+    """The stations running in this process.
+
+    Sessions hold a camera connection and a model, so they are not shared between processes: with several server
+    workers, a station is only visible to the worker that started it. Stations need a single-process deployment.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def start(self, name, source, model_path, class_names):
+        with self._lock:
+            previous = self._sessions.pop(name, None)
+        if previous is not None:
+            previous.stop()
+        session = StationSession(name, source, model_path, class_names).start()
+        with self._lock:
+            self._sessions[name] = session
+        return session
+
+    def stop(self, name):
+        with self._lock:
+            session = self._sessions.pop(name, None)
+        if session is not None:
+            session.stop()
+        return session
+
+    def get(self, name):
+        with self._lock:
+            return self._sessions.get(name)
+
+    def all(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+
+stations = StationManager()
@@ -0,0 +1,146 @@
+import json
+import queue
+import threading
+import time
+import uuid
+
+import cv2
+
+from jobs import run_detection
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class LiveRun:
+    """Latest annotated frame of a streaming detection, shared with its MJPEG viewers."""
+
+    def __init__(self, login_id, preview_width=None, jpeg_quality=70):
+        self.id = uuid.uuid4().hex
+        self.login_id = login_id
+        self.preview_width = preview_width  # None = no MJPEG preview, so frames aren't annotated
+        self.jpeg_quality = jpeg_quality
+        self.jpeg = None
+        self.seq = 0
+        self.finished = False
+        self.viewers = 0
+        self._cond = threading.Condition()
+
+    def publish_frame(self, frame):
+        height, width = frame.shape[:2]
+        if self.preview_width and width > self.preview_width:
+            frame = cv2.resize(frame, (self.preview_width, int(height * self.preview_width / width)),
+                               interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            return
+        with self._cond:
+            self.jpeg = buf.tobytes()
+            self.seq += 1
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+
+    def iter_mjpeg(self, timeout=30):
+        # Viewers that fall behind skip straight to the newest frame
+        seen = 0
+        with self._cond:
+            self.viewers += 1
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self.seq != seen or self.finished, timeout=timeout)
+                    if self.seq == seen:
+                        return
+                    seen, jpeg = self.seq, self.jpeg
+                yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+        finally:
+            with self._cond:
+                self.viewers -= 1
+
+
+_runs = {}
+_runs_lock = threading.Lock()
+
+
+def new_run(login_id, preview_width=None):
+    # Registered by stream_detection once the response is iterated, so a client that leaves early leaks nothing
+    return LiveRun(login_id, preview_width)
+
+
+def _register_run(run):
+    with _runs_lock:
+        _runs[run.id] = run
+
+
+def get_run(run_id, login_id):
+    with _runs_lock:
+        run = _runs.get(run_id)
+    if run is None or run.login_id != login_id:
+        return None
+    return run
+
+
+def end_run(run):
+    run.finish()
+    with _runs_lock:
+        _runs.pop(run.id, None)
+
+
+class StreamClosed(Exception):
+    """Raised inside the detection thread once the SSE client has gone away."""
+
+
+def stream_detection(app, video_path, sampling, login_id, run, mjpeg_url=None, min_interval=0.1, max_pending=64):
+    """Yields server-sent events with per-class counts as frames are processed.
+
+    Detection runs on its own thread and hands events over through a queue, so a slow client only delays its own
+    events: the model is never held while waiting on the socket. Progress events are dropped while max_pending are
+    unsent; the client still gets the newest counts once it catches up.
+    """
+    events = queue.Queue()
+    closed = threading.Event()
+    last_sent = [0.0]
+
+    def on_detection(detection):
+        if closed.is_set():
+            raise StreamClosed()
+        if run.preview_width:
+            run.publish_frame(detection.frame)
+        now = time.monotonic()
+        if now - last_sent[0] >= min_interval and events.qsize() < max_pending:
+            events.put(sse('progress', {'frame': detection.frame_num, 'counts': detection.counts}))
+            last_sent[0] = now
+
+    def work():
+        try:
+            with app.app_context():
+                # Small batches keep the time to the first result low
+                df = run_detection(app, video_path, sampling, login_id, on_detection=on_detection,
+                                   batch_size=app.config['DETECT_STREAM_BATCH_SIZE'], annotate=bool(run.preview_width))
+            events.put(sse('done', {'result': df.to_dict(orient="records"), 'detection_id': df.attrs.get('detection_id'),
+                                    'cached': df.attrs['cached']}))
+        except StreamClosed:
+            pass
+        except Exception as e:
+            events.put(sse('error', {'error': str(e)}))
+        finally:
+            events.put(None)
+            end_run(run)
+
+    # Like the rest of this body, runs when the response is first iterated; work() unregisters the run
+    _register_run(run)
+    threading.Thread(target=work, daemon=True, name=f'stream-{run.id[:8]}').start()
+    try:
+        yield sse('start', {'run_id': run.id, 'mjpeg_url': mjpeg_url})
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            yield event
+    finally:
+        closed.set()
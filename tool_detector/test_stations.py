@@ -0,0 +1,128 @@
+import functools
+import http.server
+import shutil
+import subprocess
+import threading
+import time
+
+import pytest
+
+# The stand-in camera is a clip generated and streamed over HTTP, so only ffmpeg is needed, not a device
+if shutil.which('ffmpeg') is None:
+    pytest.skip("ffmpeg is not installed", allow_module_level=True)
+
+import numpy as np
+
+from detect import ToolDetector
+from registry import registry
+from sources import CaptureSource, LatestFrameGrabber
+from stations import StationSession
+
+CLASS_NAMES = ['drill', 'hammer']
+
+
+class _Array:
+    # Stands in for the torch tensors on ultralytics results
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float32)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+    def __iter__(self):
+        return iter(self.values)
+
+
+class _Boxes:
+    def __init__(self, classes):
+        self.cls = _Array(classes)
+        self.conf = _Array([0.9] * len(classes))
+        self.xyxy = _Array([[10, 10, 50, 50]] * len(classes))
+
+
+class _Results:
+    def __init__(self, classes):
+        self.boxes = _Boxes(classes)
+
+
+class SlowModel:
+    """Sees a drill in every frame and takes `delay` seconds per call, slower than the stream delivers."""
+
+    def __init__(self, delay=0.1):
+        self.delay = delay
+
+    def __call__(self, frame, **kwargs):
+        time.sleep(self.delay)
+        return [_Results([0])]
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture(scope='module')
+def stream_url(tmp_path_factory):
+    # 3 s of 10 fps test pattern as MPEG-TS, which ffmpeg can read over plain HTTP without seeking
+    directory = tmp_path_factory.mktemp('stream')
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc=size=320x240:rate=10',
+                    '-t', '3', '-pix_fmt', 'yuv420p', '-f', 'mpegts', str(directory / 'clip.ts')], check=True)
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(directory))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/clip.ts'
+    server.shutdown()
+    server.server_close()
+
+
+def test_capture_source_parses_stream_url(stream_url):
+    source = CaptureSource.parse(stream_url)
+    assert source.kind == 'stream'
+    assert source.is_live
+    cap = source.open()
+    try:
+        assert cap.isOpened()
+        ret, frame = cap.read()
+        assert ret and frame.shape[:2] == (240, 320)
+    finally:
+        cap.release()
+
+
+def test_grabber_drops_frames_for_slow_consumer(stream_url):
+    grabber = LatestFrameGrabber(CaptureSource.parse(stream_url), reconnect_delay=0.1).start()
+    try:
+        frame, captured_at = grabber.read(timeout=10.0)
+        assert frame is not None and captured_at is not None
+        time.sleep(1.0)  # the consumer falls behind; only the newest frame is kept
+        frame, _ = grabber.read(timeout=10.0)
+        assert frame is not None
+        assert grabber.dropped > 0
+        assert grabber.grabbed > grabber.dropped
+    finally:
+        grabber.stop()
+    assert not grabber.connected
+
+
+def test_station_session_reports_counts(stream_url, monkeypatch):
+    monkeypatch.setattr(registry, 'new_detector',
+                        lambda model_path, class_names: ToolDetector(model_path, class_names, model=SlowModel()))
+    session = StationSession('crib-1', CaptureSource.parse(stream_url), 'model.pt', CLASS_NAMES).start()
+    try:
+        assert wait_for(lambda: session.processed >= 5 and session.grabber.dropped > 0)
+        status = session.status()
+        assert status['running'] and status['error'] is None
+        assert status['counts'] == {'drill': 1, 'hammer': 0, 'total': 1}
+        assert status['missing'] == ['hammer']
+        assert status['dropped'] > 0
+        assert status['fps'] > 0
+        assert status['latency_ms'] is not None
+    finally:
+        session.stop()
+    assert not session.running
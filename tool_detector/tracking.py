@@ -0,0 +1,45 @@
+from collections import Counter, defaultdict
+
+from video import TRACKERS
+
+# Trackers use low-confidence boxes in their second association pass, so inference keeps them
+TRACK_CONF = 0.1
+
+
+class TrackCounter:
+    """Counts unique tools per class across a video from tracker IDs, instead of presence in one frame."""
+
+    def __init__(self, class_names, tracker='bytetrack', frame_rate=30.0, min_hits=2):
+        if tracker not in TRACKERS:
+            raise ValueError(f"tracker must be one of {', '.join(TRACKERS)}")
+        # Imported here so only tracking mode depends on ultralytics' tracker internals
+        import yaml
+        from ultralytics.trackers.track import TRACKER_MAP
+        from ultralytics.utils import IterableSimpleNamespace
+        from ultralytics.utils.checks import check_yaml
+
+        with open(check_yaml(f'{tracker}.yaml'), encoding='utf-8') as f:
+            cfg = IterableSimpleNamespace(**yaml.safe_load(f))
+        # track_buffer is in updates and tuned for 30 fps; keyframes arrive at frame_rate, so keep it ~1 s of video
+        cfg.track_buffer = max(1, round(cfg.track_buffer * frame_rate / 30))
+        self.tracker = TRACKER_MAP[cfg.tracker_type](args=cfg)
+        self.class_names = class_names
+        self.min_hits = min_hits  # keyframes a track needs before it counts; filters one-off false positives
+        self._hits = Counter()
+        self._votes = defaultdict(Counter)  # track id -> class votes, a track counts once for its majority class
+
+    def update(self, result, frame):
+        tracks = self.tracker.update(result.boxes.cpu().numpy(), frame)
+        for track in tracks:
+            track_id, cls = int(track[4]), int(track[6])
+            self._hits[track_id] += 1
+            self._votes[track_id][cls] += 1
+        return self.counts()
+
+    def counts(self):
+        per_class = Counter(
+            votes.most_common(1)[0][0] for track_id, votes in self._votes.items() if self._hits[track_id] >= self.min_hits
+        )
+        class_counts = {name: per_class.get(cls, 0) for cls, name in enumerate(self.class_names)}
+        class_counts['total'] = sum(class_counts.values())
+        return class_counts
@@ -0,0 +1,287 @@
+import math
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+from metrics import metrics
+
+_END = object()
+
+TRACKERS = ('bytetrack', 'botsort')  # multi-object trackers for tracking mode, see tracking.py
+
+
+class SamplingPolicy:
+    """Which frames of a video get decoded and sent to the model."""
+
+    def __init__(self, stride=1, sample_fps=None, tail_seconds=None, stable_frames=None, tracker=None):
+        if stride < 1:
+            raise ValueError("stride must be at least 1")
+        if sample_fps is not None and sample_fps <= 0:
+            raise ValueError("sample_fps must be positive")
+        if tail_seconds is not None and tail_seconds <= 0:
+            raise ValueError("tail_seconds must be positive")
+        if stable_frames is not None and stable_frames < 1:
+            raise ValueError("stable_frames must be at least 1")
+        if tracker is not None and tracker not in TRACKERS:
+            raise ValueError(f"tracker must be one of {', '.join(TRACKERS)}")
+        self.stride = stride                # analyze every Nth frame
+        self.sample_fps = sample_fps        # analyze N frames per second of video, whatever the source fps
+        self.tail_seconds = tail_seconds    # only analyze the last N seconds
+        self.stable_frames = stable_frames  # stop once N consecutive samples agree
+        self.tracker = tracker              # count unique tracked tools over the sampled keyframes, not presence
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(
+            stride=args.get('stride', 1, type=int),
+            sample_fps=args.get('sample_fps', None, type=float),
+            tail_seconds=args.get('tail_seconds', None, type=float),
+            stable_frames=args.get('stable_frames', None, type=int),
+            tracker=args.get('tracker') or None,
+        )
+
+    def to_dict(self):
+        return {
+            'stride': self.stride,
+            'sample_fps': self.sample_fps,
+            'tail_seconds': self.tail_seconds,
+            'stable_frames': self.stable_frames,
+            'tracker': self.tracker,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**(data or {}))
+
+    def step(self, fps):
+        if self.sample_fps:
+            return max(float(self.stride), fps / self.sample_fps)
+        return float(self.stride)
+
+    def start_frame(self, fps, frame_count):
+        if self.tail_seconds and frame_count > 0:
+            return max(0, frame_count - int(self.tail_seconds * fps))
+        return 0
+
+
+class Preprocessor:
+    """Crops the region of interest and resizes once, straight to the model's input size."""
+
+    def __init__(self, input_size=640, roi=None, pool_size=0):
+        if input_size < 32 or input_size % 32:
+            raise ValueError("input_size must be a positive multiple of 32")
+        if roi is not None:
+            left, top, right, bottom = roi
+            if not (0 <= left < right <= 1 and 0 <= top < bottom <= 1):
+                raise ValueError("roi must be left,top,right,bottom fractions of the frame")
+        self.input_size = input_size  # long side; the model is called with the same imgsz so it doesn't resize again
+        self.roi = tuple(roi) if roi is not None else None
+        self.pool_size = pool_size  # >0: write into a ring of reused buffers instead of a new array per frame
+        self._pool = []
+        self._next = 0
+
+    @staticmethod
+    def parse_roi(text):
+        # "0.1,0.4,0.9,1" -> the tool tray in the lower part of the frame
+        if not text:
+            return None
+        try:
+            roi = tuple(float(v) for v in text.split(','))
+        except ValueError:
+            raise ValueError("roi must be left,top,right,bottom fractions of the frame")
+        if len(roi) != 4:
+            raise ValueError("roi must be left,top,right,bottom fractions of the frame")
+        return roi
+
+    def to_dict(self):
+        return {'input_size': self.input_size, 'roi': list(self.roi) if self.roi else None}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**(data or {}))
+
+    def with_pool(self, pool_size):
+        return Preprocessor(self.input_size, self.roi, pool_size)
+
+    def crop(self, frame):
+        if self.roi is None:
+            return frame
+        height, width = frame.shape[:2]
+        left, top, right, bottom = self.roi
+        return frame[int(top * height):int(bottom * height), int(left * width):int(right * width)]  # a view, no copy
+
+    def output_size(self, width, height):
+        scale = self.input_size / max(width, height)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def __call__(self, frame):
+        frame = self.crop(frame)
+        height, width = frame.shape[:2]
+        size = self.output_size(width, height)
+        out = self._buffer((size[1], size[0]) + frame.shape[2:], frame.dtype) if self.pool_size else None
+        if size == (width, height):
+            if out is None:
+                return frame
+            np.copyto(out, frame)
+            return out
+        return cv2.resize(frame, size, dst=out, interpolation=cv2.INTER_LINEAR)
+
+    def _buffer(self, shape, dtype):
+        if self._pool and self._pool[0].shape != shape:
+            self._pool = []  # the source size changed
+        if len(self._pool) < self.pool_size:
+            self._pool.append(np.empty(shape, dtype))
+            return self._pool[-1]
+        buffer = self._pool[self._next]
+        self._next = (self._next + 1) % self.pool_size
+        return buffer
+
+
+def demo_video_path(tool_source):
+    # tool1.MOV = Full classes | tool2.MOV = One by one | tool3.MOV = Checking missing
+    return os.path.join('demo', os.path.basename(tool_source))   # e.g. demo/tool1.mp4
+
+
+def probe(video_path):
+    # (fps, frame count) without decoding anything
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return cap.get(cv2.CAP_PROP_FPS), int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        cap.release()
+
+
+class FrameReader:
+    """Decodes frames on a producer thread into a bounded queue.
+
+    With a preprocessor, frames come from a ring of reused buffers: a frame stays valid while the consumer
+    holds no more than held_frames others (e.g. one batch) besides it.
+    """
+
+    def __init__(self, video_path, preprocess=None, queue_size=32, sampling=None, start_frame=None, stop_frame=None,
+                 held_frames=0):
+        self.cap = cv2.VideoCapture(video_path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)  # Get frames per second
+        if not self.fps or self.fps <= 0:
+            self.cap.release()
+            raise ValueError("Could not retrieve FPS from video.")
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # Queued frames, the consumer's frames and the one being decoded all need their own buffer
+        self.preprocess = preprocess.with_pool(queue_size + held_frames + 3) if preprocess else None
+        self.sampling = sampling or SamplingPolicy()
+        # Optional [start_frame, stop_frame) window, e.g. one segment of a sharded video
+        self.start_frame = start_frame
+        self.stop_frame = stop_frame
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.cap.release()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                break
+            yield item
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        # Samples sit on a fixed grid (first + k * step) so a window picks the same frames as a full pass
+        first = self.sampling.start_frame(self.fps, self.frame_count)
+        step = self.sampling.step(self.fps)
+        k = 0
+        decoded = None  # decode buffer, reused once the preprocessor has copied out of it
+        if self.start_frame is not None and self.start_frame > first:
+            # First k whose sample (the first frame at or after first + k * step) falls inside the window
+            k = math.floor((self.start_frame - 1 - first) / step) + 1
+            while first + k * step <= self.start_frame - 1:
+                k += 1
+            while k > 0 and first + (k - 1) * step > self.start_frame - 1:
+                k -= 1
+        frame_num = max(first, self.start_frame or 0)
+        if frame_num:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
+        try:
+            while not self._stop.is_set():
+                if self.stop_frame is not None and frame_num >= self.stop_frame:
+                    break
+                next_sample = first + k * step
+                if frame_num < next_sample:
+                    # grab() advances without decoding the skipped frame
+                    if not self.cap.grab():
+                        break
+                    frame_num += 1
+                    continue
+                with metrics.span('decode'):
+                    ret, frame = self.cap.read(decoded)
+                if not ret:
+                    break
+                k += 1
+                if self.preprocess:
+                    with metrics.span('resize'):
+                        decoded, frame = frame, self.preprocess(frame)
+                self._put((frame_num, frame))
+                frame_num += 1
+        except Exception as e:
+            self._error = e
+        finally:
+            self._put(_END)
+
+    def _put(self, item):
+        # Time out periodically so stop() can unblock a producer waiting on a full queue
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+class VideoSink:
+    """Writes annotated frames to an MP4 file."""
+
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self._writer = None
+
+    def write(self, frame):
+        if self._writer is None:
+            height, width = frame.shape[:2]
+            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+            self._writer = cv2.VideoWriter(self.path, fourcc, self.fps, (width, height))
+        self._writer.write(frame)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()